@@ -1,28 +1,44 @@
 import streamlit as st
+import numpy as np
+import pandas as pd
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import os
+import random
 import time
 import copy
+import functools
+import itertools
 import base64
+import json
 import hashlib
+import hmac
 import toml
 import requests
 import logging
-from datetime import datetime
-
-# ═══════════════════════════════════════════════════════════
-#  LOGGING CONFIG
-# ═══════════════════════════════════════════════════════════
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("coachbot.log"),
-        logging.StreamHandler()
-    ]
-)
-logger = logging.getLogger(__name__)
+import logging.handlers
+import queue
+import atexit
+import re
+import sqlite3
+import threading
+import csv
+import bisect
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from datetime import datetime, date
+from email.utils import parsedate_to_datetime
+from concurrent.futures import Future
+from requests.adapters import HTTPAdapter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow only powers the downscaled WebP background
+    Image = None
 
 USERS_FILE = "users.toml"
+USERS_DB = "users.db"
+PROGRESS_DB = "progress.db"
 
 # ═══════════════════════════════════════════════════════════
 #  API KEY — from st.secrets or env fallback
@@ -36,13 +52,121 @@ def get_gemini_key():
         pass
     return (os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY") or "").strip()
 
+def get_setting(name, default=None):
+    try:
+        val = st.secrets.get(name)
+        if val is not None:
+            return val
+    except Exception:
+        pass
+    return os.environ.get(name, default)
+
+# ═══════════════════════════════════════════════════════════
+#  LOGGING CONFIG
+# ═══════════════════════════════════════════════════════════
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps({"ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+                           "level": record.levelname, "logger": record.name, "thread": record.threadName,
+                           "msg": record.getMessage()}, ensure_ascii=False)
+
+def queued_handler(*targets):
+    # Callers only enqueue; one listener thread per pipeline does the formatting and disk I/O.
+    q = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(q)
+    handler.listener = logging.handlers.QueueListener(q, *targets, respect_handler_level=True)
+    handler.listener.start()
+    atexit.register(handler.listener.stop)
+    return handler
+
+def install_handler(log, handler):
+    # Swap out any pipeline an earlier copy of this script installed, so reruns and
+    # hot reloads never stack duplicate handlers.
+    for old in [h for h in log.handlers if getattr(h, "listener", None)]:
+        log.removeHandler(old); old.listener.stop(); atexit.unregister(old.listener.stop)
+    log.addHandler(handler)
+
+@st.cache_resource(show_spinner=False)
+def setup_logging():
+    path = get_setting("LOG_FILE", "coachbot.log")
+    if str(get_setting("LOG_ROTATE", "size")).lower() == "time":
+        file_h = logging.handlers.TimedRotatingFileHandler(path, when=get_setting("LOG_ROTATE_WHEN", "midnight"),
+                                                           backupCount=int(get_setting("LOG_BACKUPS", 7)), encoding="utf-8")
+    else:
+        file_h = logging.handlers.RotatingFileHandler(path, maxBytes=int(get_setting("LOG_MAX_BYTES", 10 * 1024 * 1024)),
+                                                      backupCount=int(get_setting("LOG_BACKUPS", 7)), encoding="utf-8")
+    file_h.setFormatter(JsonFormatter())
+    console_h = logging.StreamHandler()
+    console_h.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    root = logging.getLogger()
+    root.setLevel(str(get_setting("LOG_LEVEL", "INFO")).upper())
+    # Per-module overrides, e.g. LOG_LEVELS="urllib3=WARNING,coachbot.telemetry=DEBUG"
+    for item in filter(None, str(get_setting("LOG_LEVELS", "")).split(",")):
+        name, _, level = item.partition("=")
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
+    install_handler(root, queued_handler(file_h, console_h))
+    return root
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
 # ═══════════════════════════════════════════════════════════
 #  GEMINI AI
 # ═══════════════════════════════════════════════════════════
 GEMINI_MODEL = "gemini-3-flash-preview"
 
 
-def get_startup_bg_style():
+# One keep-alive HTTP client per process — every session shares its connection pool,
+# so chat turns and retries reuse an open TLS connection instead of handshaking again.
+class GeminiClient:
+    def __init__(self, pool_connections=4, pool_maxsize=16, pool_block=False):
+        self.warmed_at = 0.0
+        self.session = requests.Session()
+        self.session.headers.update({"Connection": "keep-alive"})
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                   pool_block=pool_block, max_retries=0)
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.limits = {"pool_connections": pool_connections, "pool_maxsize": pool_maxsize, "pool_block": pool_block}
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    def post(self, url, **kwargs):
+        with self._lock:
+            self._calls += 1
+        return self.session.post(url, **kwargs)
+
+    def pool_stats(self):
+        # urllib3 counts every request and every fresh TCP/TLS connection per host pool;
+        # a request that did not open a new connection reused a pooled keep-alive one.
+        reqs = conns = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            reqs += getattr(pool, "num_requests", 0)
+            conns += getattr(pool, "num_connections", 0)
+        return {"calls": self._calls, "requests": reqs, "hits": max(reqs - conns, 0),
+                "misses": conns, **self.limits}
+
+
+@st.cache_resource(show_spinner=False)
+def get_gemini_client():
+    client = GeminiClient(
+        pool_connections=int(get_setting("GEMINI_POOL_CONNECTIONS", 4)),
+        pool_maxsize=int(get_setting("GEMINI_POOL_MAXSIZE", 16)),
+        pool_block=str(get_setting("GEMINI_POOL_BLOCK", "false")).lower() in ("1", "true", "yes"),
+    )
+    logger.info("Gemini HTTP client created with pool limits %s", client.limits)
+    return client
+
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+BG_OVERLAY = "linear-gradient(rgba(15,23,42,.55),rgba(15,23,42,.55))"
+
+@st.cache_resource(show_spinner=False)
+def _find_startup_bg():
     base_dir = os.path.dirname(__file__)
     candidates = [
         os.path.join(base_dir, "assets", "Images", "Bg Image.png"),
@@ -53,36 +177,359 @@ def get_startup_bg_style():
     ]
     for image_path in candidates:
         if os.path.exists(image_path):
-            ext = os.path.splitext(image_path)[1].lower()
-            mime = "image/jpeg" if ext in (".jpg", ".jpeg") else "image/png"
-            with open(image_path, "rb") as img_file:
-                b64 = base64.b64encode(img_file.read()).decode("utf-8")
-            return f"background:linear-gradient(rgba(15,23,42,.55),rgba(15,23,42,.55)),url('data:{mime};base64,{b64}') center/cover no-repeat;"
-    return "background:linear-gradient(135deg,#0f172a,#1e293b);"
-
-def get_ai_response(user_message, chat_history, profile):
+            return image_path
+    return None
+
+def _publish_static_bg(image_path, mtime):
+    # Writes a downscaled WebP (or a plain copy without Pillow) into ./static, which
+    # Streamlit serves with caching headers at app/static/<name>.
+    os.makedirs(STATIC_DIR, exist_ok=True)
+    max_w = int(get_setting("BG_MAX_WIDTH", 1920))
+    if Image is not None and str(get_setting("BG_WEBP", "true")).lower() in ("1", "true", "yes"):
+        name = "startup-bg.webp"
+        with Image.open(image_path) as img:
+            img = img.convert("RGB")
+            if img.width > max_w:
+                img = img.resize((max_w, round(img.height * max_w / img.width)))
+            img.save(os.path.join(STATIC_DIR, name), "WEBP", quality=80)
+    else:
+        name = "startup-bg" + os.path.splitext(image_path)[1].lower()
+        with open(image_path, "rb") as src, open(os.path.join(STATIC_DIR, name), "wb") as dst:
+            dst.write(src.read())
+    return f"./app/static/{name}?v={mtime}"
+
+@st.cache_data(show_spinner=False)
+def _startup_bg_css(image_path, mtime, static_serving):
+    if static_serving:
+        try:
+            return f"background:{BG_OVERLAY},url('{_publish_static_bg(image_path, mtime)}') center/cover no-repeat;"
+        except Exception as e:
+            logger.warning("Could not publish background to static/: %s", e)
+    ext = os.path.splitext(image_path)[1].lower()
+    mime = "image/jpeg" if ext in (".jpg", ".jpeg") else "image/png"
+    with open(image_path, "rb") as img_file:
+        b64 = base64.b64encode(img_file.read()).decode("utf-8")
+    return f"background:{BG_OVERLAY},url('data:{mime};base64,{b64}') center/cover no-repeat;"
+
+def get_startup_bg_style():
+    image_path = _find_startup_bg()
+    try:
+        mtime = os.stat(image_path).st_mtime_ns if image_path else None
+    except OSError:
+        mtime = None
+    if mtime is None:
+        return "background:linear-gradient(135deg,#0f172a,#1e293b);"
+    return _startup_bg_css(image_path, mtime, bool(st.get_option("server.enableStaticServing")))
+
+@st.cache_data(show_spinner=False)
+def _stylesheet_html(name, mtime, static_serving):
+    if static_serving:
+        return f'<link rel="stylesheet" href="./app/static/{name}?v={mtime}">'
+    with open(os.path.join(STATIC_DIR, name), encoding="utf-8") as f:
+        return f"<style>{f.read()}</style>"
+
+def load_stylesheet(name):
+    # Streamlit drops any element a run does not re-emit, so the sheet still has to be
+    # referenced on every run; a ~80-byte <link> to a browser-cached asset replaces
+    # the full inline <style> (which remains the fallback without static serving).
+    try:
+        mtime = os.stat(os.path.join(STATIC_DIR, name)).st_mtime_ns
+    except OSError:
+        logger.warning("Stylesheet static/%s is missing", name); return
+    st.markdown(_stylesheet_html(name, mtime, bool(st.get_option("server.enableStaticServing"))), unsafe_allow_html=True)
+
+# Exact-match reply cache in front of Gemini. Keys are a hash of the normalised prompt
+# window, so "Hi!" and "hi" from athletes with the same profile share one reply.
+class ResponseCache:
+    def __init__(self, ttl=3600, max_entries=512, max_bytes=4 * 1024 * 1024, db_path=None, disk_max_bytes=64 * 1024 * 1024):
+        self.ttl, self.max_entries, self.max_bytes, self.disk_max_bytes = ttl, max_entries, max_bytes, disk_max_bytes
+        self._mem = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS response_cache (key TEXT PRIMARY KEY, text TEXT NOT NULL,"
+                             " size INTEGER NOT NULL, expires REAL NOT NULL, used REAL NOT NULL)")
+            self._db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit and hit[0] > now:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return hit[1]
+            if hit:
+                self._drop(key)
+            if self._db is not None:
+                row = self._db.execute("SELECT text, expires FROM response_cache WHERE key=?", (key,)).fetchone()
+                if row and row[1] > now:
+                    self._db.execute("UPDATE response_cache SET used=? WHERE key=?", (now, key))
+                    self._db.commit()
+                    self._store(key, row[0], row[1])
+                    self.hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, key, text):
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._store(key, text, expires)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO response_cache VALUES (?,?,?,?,?)",
+                                 (key, text, size, expires, time.time()))
+                self._db.execute("DELETE FROM response_cache WHERE expires<=?", (time.time(),))
+                total = self._db.execute("SELECT COALESCE(SUM(size),0) FROM response_cache").fetchone()[0]
+                while total > self.disk_max_bytes:
+                    old = self._db.execute("SELECT key, size FROM response_cache ORDER BY used LIMIT 1").fetchone()
+                    self._db.execute("DELETE FROM response_cache WHERE key=?", (old[0],))
+                    total -= old[1]
+                self._db.commit()
+
+    def _store(self, key, text, expires):
+        if key in self._mem:
+            self._drop(key)
+        self._mem[key] = (expires, text)
+        self._bytes += len(text.encode("utf-8"))
+        while self._mem and (len(self._mem) > self.max_entries or self._bytes > self.max_bytes):
+            self._drop(next(iter(self._mem)))
+
+    def _drop(self, key):
+        _, text = self._mem.pop(key)
+        self._bytes -= len(text.encode("utf-8"))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_ratio": self.hits / total if total else 0.0,
+                "entries": len(self._mem), "bytes": self._bytes}
+
+
+@st.cache_resource(show_spinner=False)
+def get_response_cache():
+    return ResponseCache(
+        ttl=int(get_setting("GEMINI_CACHE_TTL", 3600)),
+        max_entries=int(get_setting("GEMINI_CACHE_ENTRIES", 512)),
+        max_bytes=int(get_setting("GEMINI_CACHE_BYTES", 4 * 1024 * 1024)),
+        db_path=get_setting("GEMINI_CACHE_DB") or None,
+        disk_max_bytes=int(get_setting("GEMINI_CACHE_DISK_BYTES", 64 * 1024 * 1024)),
+    )
+
+def _normalise_prompt(text):
+    return re.sub(r"\s+", " ", text).strip().strip("!?.,").lower()
+
+def response_cache_key(payload, profile=None):
+    # The system prompt is part of the key even when the payload only carries a
+    # cachedContent handle, so replies never cross between athlete profiles.
+    window = [(c["role"], _normalise_prompt(" ".join(p.get("text", "") for p in c["parts"])))
+              for c in payload["contents"]]
+    if profile is not None: system = get_prompt_registry().get(profile)['text']
+    else: system = " ".join(p.get("text", "") for p in payload.get("system_instruction", {}).get("parts", [])) or payload.get("cachedContent", "")
+    raw = json.dumps({"model": GEMINI_MODEL, "system": re.sub(r"\s+", " ", system).strip(),
+                      "contents": window, "config": payload.get("generationConfig", {})}, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.stamp = time.monotonic()
+
+    def wait_time(self, n):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.stamp) * self.rate)
+        self.stamp = now
+        n = min(n, self.capacity)
+        return 0.0 if self.level >= n else (n - self.level) / self.rate
+
+    def take(self, n):
+        self.level -= min(n, self.capacity)
+
+    def give(self, n):
+        self.level = min(self.capacity, self.level + n)
+
+
+# One limiter per process for the shared API key: requests/min and tokens/min buckets,
+# plus a global pause whenever Gemini answers 429, so no session keeps hammering it.
+class GeminiRateLimiter:
+    def __init__(self, rpm=30, tpm=1_000_000):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.paused_until = 0.0
+        self._cond = threading.Condition()
+        self.granted = self.rejected = self.throttled_429 = 0
+        self.wait_total = 0.0
+
+    def _wait_time(self, tokens):
+        return max(self.requests.wait_time(1), self.tokens.wait_time(tokens), self.paused_until - time.time())
+
+    def acquire(self, tokens, cancel=None, max_wait=45.0):
+        start = time.monotonic()
+        deadline = start + max_wait
+        with self._cond:
+            while True:
+                wait = self._wait_time(tokens)
+                if wait <= 0:
+                    self.requests.take(1); self.tokens.take(tokens)
+                    self.granted += 1; self.wait_total += time.monotonic() - start
+                    return True
+                if cancel is not None and cancel.is_set():
+                    return False
+                if time.monotonic() + wait > deadline:
+                    self.rejected += 1
+                    return False
+                self._cond.wait(min(wait, 1.0))
+
+    def refund(self, tokens):
+        # Hands back a reservation that never turned into an API call (e.g. a cache hit).
+        with self._cond:
+            self.requests.give(1); self.tokens.give(tokens)
+            self._cond.notify_all()
+
+    def pause(self, seconds):
+        with self._cond:
+            self.throttled_429 += 1
+            self.paused_until = max(self.paused_until, time.time() + seconds)
+
+    def stats(self):
+        return {"granted": self.granted, "rejected": self.rejected, "throttled_429": self.throttled_429,
+                "avg_wait_s": self.wait_total / self.granted if self.granted else 0.0,
+                "paused_for_s": max(0.0, self.paused_until - time.time())}
+
+
+@st.cache_resource(show_spinner=False)
+def get_rate_limiter():
+    return GeminiRateLimiter(rpm=int(get_setting("GEMINI_RPM", 30)), tpm=int(get_setting("GEMINI_TPM", 1_000_000)))
+
+def approx_tokens(text):
+    return max(1, len(text) // 4)
+
+def estimate_request_tokens(payload):
+    # Input estimate plus the output ceiling, since tokens/min counts both directions.
+    return approx_tokens(json.dumps(payload.get("contents", [])) + json.dumps(payload.get("system_instruction", {}))) \
+        + payload.get("generationConfig", {}).get("maxOutputTokens", 0)
+
+def backoff_delay(attempt, base=1.0, cap=20.0):
+    # Exponential backoff with "equal jitter": half fixed, half random.
+    d = min(cap, base * 2 ** attempt)
+    return d / 2 + random.uniform(0, d / 2)
+
+def retry_after_seconds(response, cap=60.0):
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        secs = float(value)
+    except ValueError:
+        try: secs = (parsedate_to_datetime(value) - datetime.now(parsedate_to_datetime(value).tzinfo)).total_seconds()
+        except (TypeError, ValueError): return None
+    return min(max(secs, 0.0), cap)
+
+BUSY_MSG = "⏳ Gemini is busy right now. Please try again in a minute."
+
+def gemini_url(method, api_key):
+    base = str(get_setting("GEMINI_API_BASE", "https://generativelanguage.googleapis.com")).rstrip("/")
+    if method == "cachedContents":
+        return f"{base}/v1beta/cachedContents?key={api_key}"
+    url = f"{base}/v1beta/models/{GEMINI_MODEL}:{method}?key={api_key}"
+    return url + "&alt=sse" if method == "streamGenerateContent" else url
+
+def gemini_unavailable_reason():
     api_key = get_gemini_key()
     if not api_key or api_key == "your-gemini-api-key-here":
         return ("⚠️ **Gemini API Key not configured.**\n\n"
                 "Edit `.streamlit/secrets.toml` and set:\n"
                 "```\nGEMINI_API_KEY = 'your-real-key'\n```\n"
                 "Get a free key at **aistudio.google.com**")
-
-    now_ts = time.time()
-    retry_after_until = st.session_state.get("gemini_retry_after", 0.0)
-    if now_ts < retry_after_until:
-        wait_for = int(retry_after_until - now_ts)
-        return f"⏳ Gemini is rate-limited. Please wait about {max(wait_for, 1)}s and try again."
-
-    sport     = profile.get("sport", "athletics")
-    goal      = profile.get("goal") or "Improve Performance"
-    pos       = profile.get("position", "")
-    intensity = profile.get("intensity", "Moderate")
-    diet      = profile.get("diet", "Standard")
-    injury    = profile.get("injury") or "None"
-    age       = profile.get("age", "unknown")
-
-    system_text = f"""You are Next Gen Sports Lab's AI coaching assistant, an elite AI performance coach.
+    return None
+
+class ContextBuilder:
+    # Packs the newest chat turns into an input-token budget and folds older ones into a
+    # short extractive summary (first sentence of each turn), newest first.
+    def __init__(self, budget, summary_budget):
+        self.budget = budget
+        self.summary_budget = summary_budget
+        self._lines = {}  # user -> {message key: summary line}, so a turn is only condensed once
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.input_tokens = 0
+        self.summarised_turns = 0
+
+    @staticmethod
+    def summary_line(msg):
+        first = re.split(r"(?<=[.!?])\s|\n", msg["text"].strip(), maxsplit=1)[0]
+        first = re.sub(r"[*#_`>]+", "", first).strip()[:160]
+        return f"{'Athlete' if msg['role'] == 'user' else 'Coach'}: {first}"
+
+    def _summary(self, user, older):
+        with self._lock:
+            prev = self._lines.get(user, {})
+            lines = {}
+            for m in older:
+                key = (m["role"], m.get("time"), m["text"])
+                lines[key] = prev.get(key) or self.summary_line(m)
+            self._lines[user] = lines
+        picked, used = [], 0
+        for line in reversed(list(lines.values())):
+            used += approx_tokens(line)
+            if used > self.summary_budget:
+                break
+            picked.append(line)
+        return "\n".join(reversed(picked))
+
+    def build(self, user, user_message, chat_history, fixed_tokens):
+        # fixed_tokens covers the system instruction; the new message always goes in.
+        room = self.budget - fixed_tokens - approx_tokens(user_message)
+        if sum(approx_tokens(m["text"]) for m in chat_history) > room:
+            room -= self.summary_budget
+        recent, used = [], 0
+        for m in reversed(chat_history):
+            used += approx_tokens(m["text"])
+            if used > room:
+                break
+            recent.append(m)
+        recent.reverse()
+        older = chat_history[:len(chat_history) - len(recent)]
+        return recent, (self._summary(user or "", older) if older else ""), len(older)
+
+    def record(self, user, payload, summarised):
+        tokens = estimate_request_tokens(payload) - payload.get("generationConfig", {}).get("maxOutputTokens", 0)
+        with self._lock:
+            self.calls += 1
+            self.input_tokens += tokens
+            self.summarised_turns += summarised
+        logger.info("Gemini call for %s: ~%d input tokens, %d older turns summarised", user or "-", tokens, summarised)
+
+    def forget(self, user):
+        with self._lock:
+            self._lines.pop(user, None)
+
+    def stats(self):
+        return {"calls": self.calls, "avg_input_tokens": self.input_tokens / self.calls if self.calls else 0.0,
+                "summarised_turns": self.summarised_turns, "budget": self.budget}
+
+
+@st.cache_resource(show_spinner=False)
+def get_context_builder():
+    return ContextBuilder(budget=int(get_setting("GEMINI_CONTEXT_TOKENS", 3000)),
+                          summary_budget=int(get_setting("GEMINI_SUMMARY_TOKENS", 300)))
+
+def prompt_key(profile):
+    return (profile.get("sport", "athletics"), profile.get("position", ""), profile.get("age", "unknown"),
+            profile.get("goal") or "Improve Performance", profile.get("intensity", "Moderate"),
+            profile.get("diet", "Standard"), profile.get("injury") or "None", tuple(profile.get("injuries") or ()))
+
+def render_system_prompt(key):
+    sport, pos, age, goal, intensity, diet, injury, injuries = key
+    return f"""You are Next Gen Sports Lab's AI coaching assistant, an elite AI performance coach.
 
 ATHLETE PROFILE:
 - Sport: {sport}
@@ -92,6 +539,7 @@ ATHLETE PROFILE:
 - Training Intensity: {intensity}
 - Diet Preference: {diet}
 - Injuries/Limitations: {injury}
+- Current Injuries: {', '.join(injuries) if injuries else 'None'}
 
 INSTRUCTION RULES:
 1. ALWAYS personalize advice specifically for this athlete's sport and position. Never use generic "athletics" plans.
@@ -116,51 +564,295 @@ INSTRUCTION RULES:
 
 6. If they give short messages, still provide substantive, personalized advice."""
 
+class PromptRegistry:
+    # One rendered system instruction per distinct profile tuple, shared by every session.
+    # With GEMINI_CONTEXT_CACHE on, each instruction is also registered as a Gemini
+    # cachedContents resource so calls can send its name instead of the text.
+    def __init__(self, max_entries=1024, remote=False, ttl=3600):
+        self.max_entries, self.remote, self.ttl = max_entries, remote, ttl
+        self._entries = OrderedDict()  # key -> {'text', 'tokens', 'handle', 'expires'}
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.hits = 0
+
+    def get(self, profile):
+        key = prompt_key(profile)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                self._entries.move_to_end(key); self.hits += 1
+                return entry
+            text = render_system_prompt(key)
+            entry = {'text': text, 'tokens': approx_tokens(text), 'handle': None, 'expires': 0.0}
+            self._entries[key] = entry; self.builds += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return entry
+
+    def handle(self, entry):
+        # cachedContents name for this instruction, or None to send the text inline.
+        if not self.remote:
+            return None
+        with self._lock:
+            if entry['handle'] is False:
+                return None
+            if entry['handle'] and entry['expires'] > time.time():
+                return entry['handle']
+        # Registering the instruction is a billed call: it spends budget like any other,
+        # and a session that can't get budget quickly just sends the text inline this time.
+        if not get_rate_limiter().acquire(entry['tokens'], max_wait=5.0):
+            return None
+        body = {"model": f"models/{GEMINI_MODEL}", "systemInstruction": {"parts": [{"text": entry['text']}]},
+                "ttl": f"{self.ttl}s"}
+        try:
+            r = get_gemini_client().post(gemini_url("cachedContents", get_gemini_key()), json=body, timeout=(8, 15))
+            r.raise_for_status()
+            name = r.json()["name"]
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            # Too short to cache, model without caching support, or no endpoint: stay inline.
+            logger.info("Gemini context cache unavailable, sending system prompt inline: %s", e)
+            with self._lock:
+                entry['handle'] = False
+            return None
+        with self._lock:
+            # Another session may have registered the same instruction meanwhile; keep one name.
+            if not (entry['handle'] and entry['expires'] > time.time()):
+                entry['handle'], entry['expires'] = name, time.time() + self.ttl - 60
+            return entry['handle']
+
+    def invalidate(self, profile):
+        with self._lock:
+            self._entries.pop(prompt_key(profile), None)
+
+    def stats(self):
+        with self._lock:
+            return {"prompts": len(self._entries), "builds": self.builds, "hits": self.hits,
+                    "remote": sum(1 for e in self._entries.values() if e['handle'])}
+
+
+@st.cache_resource(show_spinner=False)
+def get_prompt_registry():
+    return PromptRegistry(max_entries=int(get_setting("GEMINI_PROMPT_CACHE", 1024)),
+                          remote=str(get_setting("GEMINI_CONTEXT_CACHE", "false")).lower() in ("1", "true", "yes"),
+                          ttl=int(get_setting("GEMINI_CONTEXT_CACHE_TTL", 3600)))
+
+def build_gemini_payload(user_message, chat_history, profile, user=None, cached=False):
+    prompt = get_prompt_registry().get(profile)
+    handle = get_prompt_registry().handle(prompt) if cached else None
+    recent, summary, summarised = get_context_builder().build(user, user_message, chat_history, prompt['tokens'])
     contents = []
-    for msg in chat_history[-5:]:
+    if summary:
+        contents.append({"role": "user", "parts": [{"text": f"(Summary of our earlier conversation)\n{summary}"}]})
+    for msg in recent:
         role = "user" if msg["role"] == "user" else "model"
         contents.append({"role": role, "parts": [{"text": msg["text"]}]})
     contents.append({"role": "user", "parts": [{"text": user_message}]})
 
     payload = {
-        "system_instruction": {"parts": [{"text": system_text}]},
         "contents": contents,
         "generationConfig": {"maxOutputTokens": 2000, "temperature": 0.4, "topP": 0.9},
     }
+    if handle: payload["cachedContent"] = handle
+    else: payload["system_instruction"] = {"parts": [{"text": prompt['text']}]}
+    return payload, summarised
+
+def usage_tokens(data):
+    usage = data.get("usageMetadata") or {}
+    if not usage:
+        return {}
+    return {'prompt_tokens': usage.get("promptTokenCount"), 'completion_tokens': usage.get("candidatesTokenCount"),
+            'cached_tokens': usage.get("cachedContentTokenCount")}
+
+class GeminiTelemetry:
+    # Per-call records for capacity planning: appended as JSON lines to GEMINI_TELEMETRY_FILE
+    # and folded into in-process histograms that render as Prometheus text.
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, path=None, window=1000):
+        self.path = path
+        self._lock = threading.Lock()
+        self._log = logging.getLogger("coachbot.telemetry")
+        if path:
+            # Own non-propagating pipeline: raw JSON lines, written off the calling thread.
+            file_h = logging.FileHandler(path, encoding="utf-8"); file_h.setFormatter(logging.Formatter("%(message)s"))
+            install_handler(self._log, queued_handler(file_h))
+            self._log.propagate = False
+            if self._log.level == logging.NOTSET: self._log.setLevel(logging.INFO)
+        self.hist = {"request": [0] * (len(self.BUCKETS) + 1), "ttfb": [0] * (len(self.BUCKETS) + 1)}
+        self.sums = {"request": 0.0, "ttfb": 0.0}
+        self.outcomes = {}
+        self.statuses = {}
+        self.tokens = {"prompt": 0, "completion": 0, "cached": 0}
+        self.attempts = 0
+        self.recent = {"request": deque(maxlen=window), "ttfb": deque(maxlen=window)}
+
+    def start(self, user, mode):
+        return {'user': user, 'mode': mode, 'attempts': 0, 'status': None, 'ttfb_ms': None,
+                'outcome': "error", '_t0': time.perf_counter()}
+
+    def _observe(self, name, seconds):
+        self.hist[name][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.sums[name] += seconds
+        self.recent[name].append(seconds)
+
+    def finish(self, call):
+        wall = time.perf_counter() - call.pop('_t0')
+        rec = {'ts': round(time.time(), 3), 'wall_ms': round(wall * 1000, 1), **call}
+        with self._lock:
+            self._observe("request", wall)
+            if call['ttfb_ms'] is not None: self._observe("ttfb", call['ttfb_ms'] / 1000)
+            self.outcomes[call['outcome']] = self.outcomes.get(call['outcome'], 0) + 1
+            if call['status']: self.statuses[call['status']] = self.statuses.get(call['status'], 0) + 1
+            for kind in ("prompt", "completion", "cached"):
+                self.tokens[kind] += call.get(f"{kind}_tokens") or 0
+            self.attempts += call['attempts']
+        if self.path:
+            self._log.info(json.dumps(rec))
+
+    def percentile(self, name, q):
+        with self._lock:
+            values = sorted(self.recent[name])
+        return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+    def stats(self):
+        with self._lock:
+            calls = sum(self.outcomes.values())
+            return {"calls": calls, "outcomes": dict(self.outcomes), "statuses": dict(self.statuses),
+                    "tokens": dict(self.tokens), "attempts": self.attempts}
+
+    def prometheus(self):
+        lines = []
+        with self._lock:
+            for name, help_text in (("request", "Wall time of a Gemini call including queueing and retries"),
+                                    ("ttfb", "Time from sending a Gemini request to its first byte or chunk")):
+                metric = f"coachbot_gemini_{name}_seconds"
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+                cumulative = 0
+                for le, count in zip([*map(str, self.BUCKETS), "+Inf"], self.hist[name]):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{le="{le}"}} {cumulative}')
+                lines += [f"{metric}_sum {self.sums[name]:.6f}", f"{metric}_count {cumulative}"]
+            lines += ["# HELP coachbot_gemini_calls_total Gemini calls by outcome", "# TYPE coachbot_gemini_calls_total counter"]
+            lines += [f'coachbot_gemini_calls_total{{outcome="{k}"}} {v}' for k, v in sorted(self.outcomes.items())]
+            lines += ["# HELP coachbot_gemini_http_responses_total HTTP responses by status code", "# TYPE coachbot_gemini_http_responses_total counter"]
+            lines += [f'coachbot_gemini_http_responses_total{{code="{k}"}} {v}' for k, v in sorted(self.statuses.items())]
+            lines += ["# HELP coachbot_gemini_tokens_total Tokens reported by usageMetadata", "# TYPE coachbot_gemini_tokens_total counter"]
+            lines += [f'coachbot_gemini_tokens_total{{kind="{k}"}} {v}' for k, v in self.tokens.items()]
+            lines += ["# HELP coachbot_gemini_attempts_total HTTP attempts including retries", "# TYPE coachbot_gemini_attempts_total counter",
+                      f"coachbot_gemini_attempts_total {self.attempts}"]
+        cs = get_response_cache().stats()
+        lines += ["# HELP coachbot_response_cache_hits_total Response cache hits", "# TYPE coachbot_response_cache_hits_total counter",
+                  f"coachbot_response_cache_hits_total {cs['hits']}",
+                  "# HELP coachbot_response_cache_misses_total Response cache misses", "# TYPE coachbot_response_cache_misses_total counter",
+                  f"coachbot_response_cache_misses_total {cs['misses']}"]
+        return "\n".join(lines) + "\n"
+
+
+@st.cache_resource(show_spinner=False)
+def get_telemetry():
+    return GeminiTelemetry(path=get_setting("GEMINI_TELEMETRY_FILE", "gemini_calls.jsonl") or None)
+
+@st.cache_resource(show_spinner=False)
+def start_metrics_server(port, host="127.0.0.1"):
+    # Optional Prometheus scrape target: GET /metrics on METRICS_PORT, started once per process.
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404); return
+            body = get_telemetry().prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("Prometheus metrics on http://%s:%d/metrics", host, port)
+    return server
+
+if get_setting("METRICS_PORT"):
+    try: start_metrics_server(int(get_setting("METRICS_PORT")), get_setting("METRICS_HOST", "127.0.0.1"))
+    except OSError as e: logger.error("Metrics server failed to start: %s", e)
+
+def get_ai_response(user_message, chat_history, profile, user=None, reserved=0):
+    # reserved: tokens the caller already took from the limiter for the first attempt.
+    telemetry = get_telemetry(); call = telemetry.start(user, "sync")
+    try:
+        return _generate(user_message, chat_history, profile, user, call, reserved)
+    finally:
+        telemetry.finish(call)
+
+def _generate(user_message, chat_history, profile, user, call, reserved=0):
+    unavailable = gemini_unavailable_reason()
+    if unavailable:
+        return unavailable
+    api_key = get_gemini_key()
+    payload, summarised = build_gemini_payload(user_message, chat_history, profile, user, cached=True)
+    cache = get_response_cache(); cache_key = response_cache_key(payload, profile)
+    cached = cache.get(cache_key)
+    limiter = get_rate_limiter()
+    if cached:
+        if reserved: limiter.refund(reserved)
+        call['outcome'] = "cache"
+        return cached
+    tokens = estimate_request_tokens(payload)
+    get_context_builder().record(user, payload, summarised)
     try:
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent?key={api_key}"
+        url = gemini_url("generateContent", api_key)
+        client = get_gemini_client()
         for attempt in range(3):
+            if reserved: reserved = 0  # first attempt rides on the admission thread's reservation
+            elif not limiter.acquire(tokens):
+                call['outcome'] = "busy"
+                return BUSY_MSG
+            call['attempts'] = attempt + 1
             try:
-                r = requests.post(url, json=payload, timeout=(8, 30))
+                r = client.post(url, json=payload, timeout=(8, 30))
             except requests.exceptions.Timeout:
                 if attempt < 2:
-                    time.sleep(1.2 * (attempt + 1))
+                    time.sleep(backoff_delay(attempt))
                     continue
                 return "⏱️ Request timed out after retries. Please try again in a few seconds."
             except requests.exceptions.ConnectionError:
                 if attempt < 2:
-                    time.sleep(1.5 * (attempt + 1))
+                    time.sleep(backoff_delay(attempt))
                     continue
                 return "🌐 Network connection issue to Gemini API. Check internet/VPN and try again."
+            call['status'] = r.status_code; call['ttfb_ms'] = round(r.elapsed.total_seconds() * 1000, 1)
             if r.status_code == 429:
+                # Pausing the shared limiter makes every session wait out Retry-After,
+                # and the next attempt's acquire() sleeps until then.
+                limiter.pause(retry_after_seconds(r) or backoff_delay(attempt + 1))
                 if attempt < 2:
-                    time.sleep(1.5 * (attempt + 1))
                     continue
-                st.session_state.gemini_retry_after = time.time() + 45
                 return "⏳ Gemini rate limit hit (429). Please wait 20-60 seconds and try again."
+            if r.status_code == 404 and "cachedContent" in payload:
+                # Cached instruction expired or was evicted server-side: resend it inline.
+                registry = get_prompt_registry(); registry.invalidate(profile)
+                payload.pop("cachedContent")
+                payload["system_instruction"] = {"parts": [{"text": registry.get(profile)['text']}]}
+                continue
             if r.status_code == 404:
                 return f"⚠️ Model `{GEMINI_MODEL}` not available for this API key/project."
             r.raise_for_status()
             data = r.json()
+            call.update(usage_tokens(data))
             candidates = data.get("candidates", [])
             if candidates:
                 parts = candidates[0].get("content", {}).get("parts", [])
                 if parts and parts[0].get("text"):
                     text = parts[0]["text"].strip()
                     if text:
+                        call['outcome'] = "ok"
+                        cache.put(cache_key, text)
                         return text
             return "⚠️ Gemini returned an empty response. Please try again."
-        return "⏳ Gemini is busy right now. Please try again in a minute."
+        call['outcome'] = "busy"
+        return BUSY_MSG
     except requests.exceptions.Timeout:
         return "⏱️ Request timed out. Please try again."
     except requests.exceptions.ConnectionError:
@@ -170,7 +862,7 @@ INSTRUCTION RULES:
         if code == 400: return "⚠️ Invalid API key. Check your secrets.toml."
         if code == 403: return "🔒 API key unauthorised. Visit aistudio.google.com."
         if code == 429:
-            st.session_state.gemini_retry_after = time.time() + 45
+            get_rate_limiter().pause(retry_after_seconds(e.response) or 45)
             return "⏳ Rate limit hit (429). Please wait ~45s and retry."
         return f"❌ API error {code}: {str(e)[:100]}"
     except requests.exceptions.RequestException as e:
@@ -178,171 +870,866 @@ INSTRUCTION RULES:
     except Exception as e:
         return f"❌ Error: {str(e)[:100]}"
 
+def streaming_enabled():
+    return str(get_setting("GEMINI_STREAMING", "true")).lower() in ("1", "true", "yes")
+
+def stream_ai_response(user_message, chat_history, profile, user=None, reserved=0):
+    # Yields text chunks from the streamGenerateContent SSE endpoint as they arrive.
+    # Anything that fails before the first chunk falls back to get_ai_response, which
+    # owns retries and the user-facing error messages.
+    telemetry = get_telemetry(); call = telemetry.start(user, "stream")
+    try:
+        yield from _stream(user_message, chat_history, profile, user, call, reserved)
+    finally:
+        telemetry.finish(call)
+
+def _stream(user_message, chat_history, profile, user, call, reserved=0):
+    unavailable = gemini_unavailable_reason()
+    if unavailable:
+        yield unavailable
+        return
+    payload, summarised = build_gemini_payload(user_message, chat_history, profile, user, cached=True)
+    cache = get_response_cache(); cache_key = response_cache_key(payload, profile)
+    cached = cache.get(cache_key)
+    limiter = get_rate_limiter()
+    if cached:
+        if reserved: limiter.refund(reserved)
+        call['outcome'] = "cache"
+        yield cached
+        return
+    url = gemini_url("streamGenerateContent", get_gemini_key())
+    sent_any = False
+    chunks = []
+    if not reserved and not limiter.acquire(estimate_request_tokens(payload)):
+        call['outcome'] = "busy"
+        yield BUSY_MSG
+        return
+    get_context_builder().record(user, payload, summarised)
+    call['attempts'] = 1; sent_at = time.perf_counter()
+    try:
+        with get_gemini_client().post(url, json=payload, timeout=(8, 30), stream=True) as r:
+            call['status'] = r.status_code
+            if r.status_code != 200:
+                if r.status_code == 429:
+                    limiter.pause(retry_after_seconds(r) or backoff_delay(1))
+                call['outcome'] = "fallback"
+                yield get_ai_response(user_message, chat_history, profile, user)
+                return
+            r.encoding = "utf-8"  # SSE has no charset header; requests would assume ISO-8859-1
+            for line in r.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = json.loads(line[5:].strip())
+                call.update(usage_tokens(data))
+                candidates = data.get("candidates", [])
+                if not candidates:
+                    continue
+                for part in candidates[0].get("content", {}).get("parts", []):
+                    if part.get("text"):
+                        if not sent_any: call['ttfb_ms'] = round((time.perf_counter() - sent_at) * 1000, 1)
+                        sent_any = True
+                        chunks.append(part["text"])
+                        yield part["text"]
+    except (requests.exceptions.RequestException, ValueError) as e:
+        if not sent_any:
+            call['outcome'] = "fallback"
+            yield get_ai_response(user_message, chat_history, profile, user)
+            return
+        logger.warning("Gemini stream interrupted: %s", e)
+        yield "\n\n⚠️ Response was interrupted. Ask again to get the rest."
+        return
+    if not sent_any:
+        yield "⚠️ Gemini returned an empty response. Please try again."
+        return
+    call['outcome'] = "ok"
+    cache.put(cache_key, "".join(chunks).strip())
+
+
+# Gemini calls run on a bounded worker pool, one pending job per user, so the script
+# thread returns immediately and the dashboard polls for the reply. Jobs wait in a
+# fair queue — a priority lane first, then round-robin across users — and a single
+# admission thread only dispatches once the shared rate limiter has room.
+class GeminiJobs:
+    def __init__(self, max_workers=8, max_age=600, priority_users=()):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini")
+        self.max_age = max_age
+        self.priority_users = set(priority_users)
+        self._jobs = {}
+        self._lanes = {"priority": OrderedDict(), "normal": OrderedDict()}
+        self._cond = threading.Condition()
+        threading.Thread(target=self._admit_loop, name="gemini-admission", daemon=True).start()
+
+    def submit(self, user, message, history, profile, stream=True):
+        with self._cond:
+            for u in [u for u, j in self._jobs.items() if time.time() - j['started'] > self.max_age]:
+                self._jobs.pop(u)['cancel'].set()
+            job = self._jobs.get(user)
+            if job and not job['future'].done():
+                return job
+            job = {'chunks': [], 'cancel': threading.Event(), 'started': time.time(), 'future': Future(),
+                   'args': (message, list(history), dict(profile), user, stream)}
+            self._jobs[user] = job
+            lane = self._lanes["priority" if user in self.priority_users else "normal"]
+            lane.setdefault(user, []).append(job)
+            self._cond.notify()
+            return job
+
+    def _next_job(self):
+        for lane in self._lanes.values():
+            while lane:
+                user, queue = next(iter(lane.items()))
+                job = queue.pop(0)
+                del lane[user]
+                if queue:
+                    lane[user] = queue  # back of the line: round-robin between users
+                if not job['cancel'].is_set():
+                    return job
+        return None
+
+    def _admit_loop(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job()
+            message, history, profile, user, stream = job['args']
+            error = None
+            try:
+                # Taking the tokens here, in queue order, is what keeps admission fair:
+                # workers never race each other for the same remaining budget.
+                tokens = estimate_request_tokens(build_gemini_payload(message, history, profile, user)[0])
+                ready = get_rate_limiter().acquire(tokens, cancel=job['cancel'])
+            except Exception as e:  # fail this job, keep admitting the others
+                logger.exception("Gemini admission failed for %s", user or "-")
+                error = e
+            if not job['future'].set_running_or_notify_cancel():
+                if not error and ready: get_rate_limiter().refund(tokens)
+                continue
+            if error: job['future'].set_exception(error)
+            elif ready: job['reserved'] = tokens; self.pool.submit(self._run, job)
+            else: job['future'].set_result(BUSY_MSG)
+
+    def _run(self, job):
+        try:
+            job['future'].set_result(self._call(job))
+        except Exception as e:
+            job['future'].set_exception(e)
+
+    def _call(self, job):
+        message, history, profile, user, stream = job['args']
+        if not stream:
+            return get_ai_response(message, history, profile, user, job['reserved'])
+        for chunk in stream_ai_response(message, history, profile, user, job['reserved']):
+            if job['cancel'].is_set():
+                return None
+            job['chunks'].append(chunk)
+        return "".join(job['chunks']).strip() or "⚠️ Gemini returned an empty response. Please try again."
+
+    def get(self, user):
+        return self._jobs.get(user)
+
+    def pop(self, user):
+        with self._cond:
+            return self._jobs.pop(user, None)
+
+    def cancel(self, user):
+        job = self.pop(user)
+        if job:
+            job['cancel'].set(); job['future'].cancel()
+
+    def queued(self):
+        with self._cond:
+            return sum(len(q) for lane in self._lanes.values() for q in lane.values())
+
+
+@st.cache_resource(show_spinner=False)
+def get_gemini_jobs():
+    priority = [u.strip() for u in str(get_setting("GEMINI_PRIORITY_USERS", "")).split(",") if u.strip()]
+    return GeminiJobs(max_workers=int(get_setting("GEMINI_WORKERS", 8)), priority_users=priority)
+
+def async_enabled():
+    return str(get_setting("GEMINI_ASYNC", "true")).lower() in ("1", "true", "yes")
+
+
+# ═══════════════════════════════════════════════════════════
+#  PASSWORDS — salted scrypt/PBKDF2, verified off the script thread
+# ═══════════════════════════════════════════════════════════
+# Stored as "scheme$params$salt$hash" so the cost can be raised later: a login whose hash
+# was made with another scheme or cost is re-hashed with the current settings. Bare
+# SHA-256 hex digests from older users.toml files are accepted once and upgraded the same
+# way; plaintext entries are hashed when a store opens (get_user_store), never compared.
+PASSWORD_HASHER = str(get_setting("PASSWORD_HASHER",
+                                  "scrypt" if hasattr(hashlib, "scrypt") else "pbkdf2_sha256")).lower()
+SCRYPT_COST = (int(get_setting("PASSWORD_SCRYPT_N", 2**14)),
+               int(get_setting("PASSWORD_SCRYPT_R", 8)),
+               int(get_setting("PASSWORD_SCRYPT_P", 1)))
+PBKDF2_ITERATIONS = int(get_setting("PASSWORD_PBKDF2_ITERATIONS", 600000))
+
+
+def _derive(scheme, params, salt, plain):
+    if scheme == "scrypt":
+        n, r, p = params
+        return hashlib.scrypt(plain.encode(), salt=salt, n=n, r=r, p=p, maxmem=128 * r * (n + p) + 2**20)
+    if scheme == "pbkdf2_sha256":
+        return hashlib.pbkdf2_hmac("sha256", plain.encode(), salt, params[0])
+    raise ValueError(f"unknown password scheme {scheme!r}")
+
+
+def _current_params(scheme):
+    return SCRYPT_COST if scheme == "scrypt" else (PBKDF2_ITERATIONS,)
+
+
+def hash_password(plain, scheme=None, params=None):
+    scheme = scheme or PASSWORD_HASHER
+    params = params or _current_params(scheme)
+    salt = os.urandom(16)
+    return "$".join([scheme, ",".join(map(str, params)), salt.hex(), _derive(scheme, params, salt, plain).hex()])
+
+
+def _parse_hash(stored):
+    parts = stored.split("$")
+    if len(parts) != 4:
+        return None
+    try:
+        return parts[0], tuple(int(x) for x in parts[1].split(",")), bytes.fromhex(parts[2]), bytes.fromhex(parts[3])
+    except ValueError:
+        return None
+
+
+def verify_password(stored, plain):
+    if not stored:
+        return False
+    parsed = _parse_hash(stored)
+    if parsed:
+        scheme, params, salt, digest = parsed
+        try:
+            return hmac.compare_digest(_derive(scheme, params, salt, plain), digest)
+        except ValueError:
+            return False
+    if not is_legacy_digest(stored):
+        return False
+    return hmac.compare_digest(stored.encode(), hashlib.sha256(plain.encode()).hexdigest().encode())
+
+
+def is_legacy_digest(stored):
+    return len(stored) == 64 and all(c in "0123456789abcdef" for c in stored.lower())
+
+
+def is_plaintext(stored):
+    # Neither a current "scheme$params$salt$hash" nor a legacy SHA-256 digest.
+    return bool(stored) and not _parse_hash(stored) and not is_legacy_digest(stored)
+
+
+def hash_plaintext_passwords(users):
+    # Hashes in place any password still stored as plaintext; returns how many were.
+    n = 0
+    for rec in users.values():
+        pw = rec.get('password') if isinstance(rec, dict) else None
+        if isinstance(pw, str) and is_plaintext(pw):
+            rec['password'] = hash_password(pw)
+            n += 1
+    return n
+
+
+def needs_rehash(stored):
+    parsed = _parse_hash(stored or "")
+    return not parsed or parsed[0] != PASSWORD_HASHER or parsed[1] != _current_params(PASSWORD_HASHER)
+
+
+# A small fixed pool bounds how many CPU/memory-hard derivations run at once, so a burst
+# of logins queues here instead of starving every other session's script thread.
+@st.cache_resource(show_spinner=False)
+def get_password_pool():
+    return ThreadPoolExecutor(max_workers=int(get_setting("PASSWORD_WORKERS", 2)), thread_name_prefix="pwhash")
+
+
+def check_password(stored, plain):
+    return get_password_pool().submit(verify_password, stored, plain).result()
+
+
+def make_password(plain):
+    return get_password_pool().submit(hash_password, plain).result()
+
 
 # ═══════════════════════════════════════════════════════════
 #  FILE HELPERS
 # ═══════════════════════════════════════════════════════════
-def hash_password(p): return hashlib.sha256(p.encode()).hexdigest()
-def _ensure_users_file():
-    if not os.path.exists(USERS_FILE):
-        open(USERS_FILE,"w").write("[users]\n")
-def load_users_from_file():
-    _ensure_users_file()
-    try: data=toml.load(USERS_FILE)
+def _ensure_users_file(path=USERS_FILE):
+    if not os.path.exists(path):
+        open(path,"w").write("[users]\n")
+def load_users_from_file(path=USERS_FILE):
+    _ensure_users_file(path)
+    try: data=toml.load(path)
     except: data={}
     u=data.get("users",{}); return u if isinstance(u,dict) else {}
-def save_users_to_file(u):
-    open(USERS_FILE,"w").write(toml.dumps({"users":u}))
-def verify_password(stored,plain):
-    if not stored: return False
-    return stored==plain or stored==hash_password(plain)
+def save_users_to_file(u,path=USERS_FILE):
+    open(path,"w").write(toml.dumps({"users":u}))
+
+# ═══════════════════════════════════════════════════════════
+#  USER STORE — point reads/writes by username
+# ═══════════════════════════════════════════════════════════
+# Legacy backend: the whole users.toml is parsed and rewritten on every call.
+class TomlUserStore:
+    def __init__(self, path=USERS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def get(self, username):
+        return load_users_from_file(self.path).get(username)
+
+    def create(self, username, record):
+        with self._lock:
+            users = load_users_from_file(self.path)
+            if username in users:
+                return False
+            users[username] = record
+            save_users_to_file(users, self.path)
+            return True
+
+    def put(self, username, record):
+        with self._lock:
+            users = load_users_from_file(self.path); users[username] = record
+            save_users_to_file(users, self.path)
+
+    def count(self):
+        return len(load_users_from_file(self.path))
+
+    def hash_plaintext(self):
+        with self._lock:
+            users = load_users_from_file(self.path)
+            n = hash_plaintext_passwords(users)
+            if n:
+                save_users_to_file(users, self.path)
+                logger.info("Hashed %d plaintext passwords in %s", n, self.path)
+            return n
+
+    bulk = True
+
+    def load_all(self):
+        return load_users_from_file(self.path)
+
+    def version(self):
+        try: return os.stat(self.path).st_mtime_ns
+        except OSError: return 0
+
+
+# Default backend: one JSON row per user in SQLite (WAL), so a signup or profile save
+# touches a single row and concurrent sessions serialise on SQLite's write lock.
+class SQLiteUserStore:
+    def __init__(self, path=USERS_DB):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def get(self, username):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM users WHERE username=?", (username,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def create(self, username, record):
+        with self._lock, self._conn:
+            cur = self._conn.execute("INSERT OR IGNORE INTO users VALUES (?,?,?)",
+                                     (username, json.dumps(record), time.time()))
+            return cur.rowcount == 1
+
+    def put(self, username, record):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO users VALUES (?,?,?)",
+                               (username, json.dumps(record), time.time()))
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    bulk = False
+
+    def version(self):
+        # data_version only moves when another connection (another process) commits.
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def migrate_from_toml(self, path=USERS_FILE):
+        # One-shot import of a legacy users.toml; the marker row stops it re-running.
+        with self._lock:
+            done = self._conn.execute("SELECT value FROM meta WHERE key='toml_migrated'").fetchone()
+        if done or not os.path.exists(path):
+            return 0
+        users = load_users_from_file(path)
+        hash_plaintext_passwords(users)
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO users VALUES (?,?,?)",
+                                   [(u, json.dumps(rec), time.time()) for u, rec in users.items()])
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('toml_migrated', ?)", (datetime.now().isoformat(),))
+        logger.info("Migrated %d users from %s into %s", len(users), path, self.path)
+        return len(users)
+
+    def hash_plaintext(self):
+        # Rows imported before passwords were hashed on import still hold plaintext, which
+        # verify_password() no longer accepts. The scan reads just the password field and
+        # only loads and rewrites the rows that need it.
+        with self._lock:
+            pws = self._conn.execute("SELECT username, json_extract(data, '$.password') FROM users").fetchall()
+        n = 0
+        for username, pw in pws:
+            if not (isinstance(pw, str) and is_plaintext(pw)):
+                continue
+            with self._lock:
+                row = self._conn.execute("SELECT data FROM users WHERE username=?", (username,)).fetchone()
+            rec = json.loads(row[0]) if row else None
+            if not hash_plaintext_passwords({username: rec}):
+                continue
+            with self._lock, self._conn:
+                # Compare-and-set on the old row, so a concurrent profile save is never overwritten.
+                cur = self._conn.execute("UPDATE users SET data=?, updated=? WHERE username=? AND data=?",
+                                         (json.dumps(rec), time.time(), username, row[0]))
+            n += cur.rowcount
+        if n:
+            logger.info("Hashed %d plaintext passwords in %s", n, self.path)
+        return n
+
+
+@st.cache_resource(show_spinner=False)
+def get_user_store():
+    backend = str(get_setting("USER_STORE", "sqlite")).lower()
+    if backend == "toml":
+        store = TomlUserStore(USERS_FILE)
+        store.hash_plaintext()
+        return store
+    store = SQLiteUserStore(get_setting("USERS_DB", USERS_DB))
+    store.migrate_from_toml(USERS_FILE)
+    store.hash_plaintext()
+    return store
+
+# Process-wide read-through/write-through cache in front of the store. It is dropped
+# whenever the store's version (file mtime or SQLite data_version) moves underneath it,
+# so a cold session costs one dictionary lookup rather than a file parse.
+class UserDirectory:
+    def __init__(self, store, max_entries=5000):
+        self.store = store
+        self.max_entries = max_entries
+        self._records = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def _revalidate(self):
+        v = self.store.version()
+        if v != self._version:
+            self._records.clear(); self._version = v
+            if self.store.bulk: self._records.update(self.store.load_all())
+
+    def _remember(self, username, record):
+        self._records[username] = copy.deepcopy(record); self._records.move_to_end(username)
+        while not self.store.bulk and len(self._records) > self.max_entries:
+            self._records.popitem(last=False)
+
+    def get(self, username):
+        with self._lock:
+            self._revalidate()
+            if username in self._records:
+                self.hits += 1; self._records.move_to_end(username)
+                return copy.deepcopy(self._records[username])
+            self.misses += 1
+            rec = None if self.store.bulk else self.store.get(username)
+            if rec is not None: self._remember(username, rec)
+            return rec
+
+    def create(self, username, record):
+        with self._lock:
+            self._revalidate()
+            if username in self._records or not self.store.create(username, record):
+                return False
+            self._version = self.store.version(); self._remember(username, record)
+            return True
+
+    def put(self, username, record):
+        with self._lock:
+            self._revalidate()
+            self.store.put(username, record)
+            self._version = self.store.version(); self._remember(username, record)
+
+
+@st.cache_resource(show_spinner=False)
+def get_user_directory():
+    return UserDirectory(get_user_store(), max_entries=int(get_setting("USER_CACHE_ENTRIES", 5000)))
+
+def get_user(username, refresh=False):
+    if refresh or username not in st.session_state.users:
+        rec = get_user_directory().get(username)
+        if rec is None:
+            st.session_state.users.pop(username, None); return None
+        st.session_state.users[username] = rec
+    return st.session_state.users[username]
+
+def save_user(username):
+    get_user_directory().put(username, st.session_state.users[username])
+
+# ═══════════════════════════════════════════════════════════
+#  PROGRESS STORE — tracker, XP, chat & notifications on disk
+# ═══════════════════════════════════════════════════════════
+# Chat and notifications are append-only logs whose seq is allocated inside the write
+# transaction, so two tabs of one user never collide. Tracker and XP are one versioned
+# JSON document per user; a save only lands on the version the session last saw, and a
+# session that lost the race merges its changes into the newer copy. Sessions keep only
+# a recent window in memory. Daily totals are kept as one numeric row per user per day,
+# written only once something is logged that day, and each write adds its delta to
+# that day's ISO-week and month rollups, so trend reads are index range scans.
+HISTORY_FIELDS=('calories','protein','carbs','fat','meals','water','ex_done','volume')
+_HIST_COLS=", ".join(HISTORY_FIELDS)
+
+def period_key(period, day):
+    if period == "month": return day[:7]
+    y, w, _ = date.fromisoformat(day).isocalendar()
+    return f"{y}-W{w:02d}"
+
+class ProgressStore:
+    def __init__(self, path=PROGRESS_DB):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS state (user TEXT, kind TEXT, data TEXT NOT NULL,"
+                               " version INTEGER NOT NULL DEFAULT 0, PRIMARY KEY(user, kind))")
+            if "version" not in [r[1] for r in self._conn.execute("PRAGMA table_info(state)")]:
+                self._conn.execute("ALTER TABLE state ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS chat (user TEXT, seq INTEGER, role TEXT, text TEXT, time TEXT, PRIMARY KEY(user, seq))")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS notifications (user TEXT, seq INTEGER, msg TEXT, time TEXT,"
+                               " read INTEGER, type TEXT, PRIMARY KEY(user, seq))")
+            nums = ", ".join(f"{k} REAL NOT NULL DEFAULT 0" for k in HISTORY_FIELDS)
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS days (user TEXT, day TEXT, {nums}, PRIMARY KEY(user, day))")
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS rollups (user TEXT, period TEXT, key TEXT, days INTEGER NOT NULL,"
+                               f" {nums}, PRIMARY KEY(user, period, key))")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS history_versions (user TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+
+    def load_state(self, user, kind):
+        # Returns (document or None, version); version 0 means nothing stored yet.
+        with self._lock:
+            row = self._conn.execute("SELECT data, version FROM state WHERE user=? AND kind=?", (user, kind)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else (None, 0)
+
+    def state_version(self, user, kind):
+        with self._lock:
+            row = self._conn.execute("SELECT version FROM state WHERE user=? AND kind=?", (user, kind)).fetchone()
+        return row[0] if row else 0
+
+    def save_state(self, user, kind, data, expect=None):
+        # Compare-and-swap on the version; returns the new version, or None if another
+        # session saved first.
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            row = self._conn.execute("SELECT version FROM state WHERE user=? AND kind=?", (user, kind)).fetchone()
+            version = row[0] if row else 0
+            if expect is not None and version != expect:
+                return None
+            self._conn.execute("INSERT OR REPLACE INTO state VALUES (?,?,?,?)", (user, kind, json.dumps(data), version + 1))
+        return version + 1
+
+    def _append(self, table, user, rows):
+        # Allocates seq under the write lock so concurrent sessions append rather than overwrite.
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            base = self._conn.execute(f"SELECT COALESCE(MAX(seq),-1)+1 FROM {table} WHERE user=?", (user,)).fetchone()[0]
+            marks = ",".join("?" * (len(rows[0]) + 2))
+            self._conn.executemany(f"INSERT INTO {table} VALUES ({marks})",
+                                   [(user, base + i, *r) for i, r in enumerate(rows)])
+        return base
+
+    def load_chat(self, user, limit, before=None):
+        q = "SELECT seq, role, text, time FROM chat WHERE user=?" + (" AND seq<?" if before is not None else "")
+        args = (user, before) if before is not None else (user,)
+        with self._lock:
+            rows = self._conn.execute(q + " ORDER BY seq DESC LIMIT ?", (*args, limit)).fetchall()
+        return [{'role': r, 'text': t, 'time': tm, 'seq': sq} for sq, r, t, tm in reversed(rows)]
+
+    def append_chat(self, user, msgs):
+        base = self._append("chat", user, [(m['role'], m['text'], m['time']) for m in msgs])
+        for i, m in enumerate(msgs):
+            m['seq'] = base + i
+
+    def clear_chat(self, user):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chat WHERE user=?", (user,))
+
+    def load_notifs(self, user, limit, before=None):
+        q = "SELECT seq, msg, time, read, type FROM notifications WHERE user=?" + (" AND seq<?" if before is not None else "")
+        args = (user, before) if before is not None else (user,)
+        with self._lock:
+            rows = self._conn.execute(q + " ORDER BY seq DESC LIMIT ?", (*args, limit)).fetchall()
+        return [{'msg': m, 'time': t, 'read': bool(rd), 'type': ty, 'seq': sq} for sq, m, t, rd, ty in rows]
+
+    def append_notifs(self, user, notifs):
+        base = self._append("notifications", user, [(n['msg'], n['time'], int(n['read']), n['type']) for n in notifs])
+        for i, n in enumerate(notifs):
+            n['seq'] = base + i
+
+    def mark_notifs_read(self, user):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE notifications SET read=1 WHERE user=? AND read=0", (user,))
+
+    def record_day(self, user, day, totals):
+        row = [totals.get(k, 0) for k in HISTORY_FIELDS]
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            old = self._conn.execute(f"SELECT {_HIST_COLS} FROM days WHERE user=? AND day=?", (user, day)).fetchone()
+            delta = [n - o for n, o in zip(row, old or [0] * len(row))]
+            if (old and not any(delta)) or (not old and not any(row)):
+                return False
+            marks = ",".join("?" * len(HISTORY_FIELDS))
+            if any(row):
+                self._conn.execute(f"INSERT OR REPLACE INTO days VALUES (?,?,{marks})", (user, day, *row))
+            else:  # everything logged that day was undone: it is untracked again
+                self._conn.execute("DELETE FROM days WHERE user=? AND day=?", (user, day))
+            days = (0 if old else 1) if any(row) else -1
+            bump = ", ".join(f"{k}={k}+excluded.{k}" for k in HISTORY_FIELDS)
+            for period in ("week", "month"):
+                self._conn.execute(f"INSERT INTO rollups VALUES (?,?,?,?,{marks}) ON CONFLICT(user, period, key)"
+                                   f" DO UPDATE SET days=days+excluded.days, {bump}",
+                                   (user, period, period_key(period, day), days, *delta))
+            self._conn.execute("INSERT INTO history_versions VALUES (?,1) ON CONFLICT(user) DO UPDATE SET version=version+1", (user,))
+        return True
+
+    def history_version(self, user):
+        with self._lock:
+            row = self._conn.execute("SELECT version FROM history_versions WHERE user=?", (user,)).fetchone()
+        return row[0] if row else 0
+
+    def load_days(self, user, start="", end="9999"):
+        with self._lock:
+            rows = self._conn.execute(f"SELECT day, {_HIST_COLS} FROM days WHERE user=? AND day BETWEEN ? AND ?"
+                                      " ORDER BY day", (user, start, end)).fetchall()
+        return [{'day': r[0], **dict(zip(HISTORY_FIELDS, r[1:]))} for r in rows]
+
+    def load_rollups(self, user, period, start="", end="9999"):
+        with self._lock:
+            rows = self._conn.execute(f"SELECT key, days, {_HIST_COLS} FROM rollups WHERE user=? AND period=?"
+                                      " AND key BETWEEN ? AND ? ORDER BY key", (user, period, start, end)).fetchall()
+        return [{'key': r[0], 'days': r[1], **dict(zip(HISTORY_FIELDS, r[2:]))} for r in rows]
+
+    def count_notifs(self, user):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM notifications WHERE user=?", (user,)).fetchone()[0]
+
+    def trim_notifs(self, user, below):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM notifications WHERE user=? AND seq<?", (user, below))
+
+
+@st.cache_resource(show_spinner=False)
+def get_progress_store():
+    return ProgressStore(get_setting("PROGRESS_DB", PROGRESS_DB))
+
+CHAT_MEMORY_LIMIT=int(get_setting("CHAT_MEMORY_LIMIT",200))
+NOTIF_MEMORY_LIMIT=int(get_setting("NOTIF_MEMORY_LIMIT",100))
+NOTIF_RETENTION=int(get_setting("NOTIF_RETENTION",1000))
+NOTIF_PAGE=8
+
+# Newest-first ring buffer of one user's notifications. The unread count is maintained on
+# add/evict/mark so the sidebar badge never scans; new entries wait in `pending` until the
+# next flush. With a backend, pages past the in-memory window are read from disk.
+class NotificationFeed:
+    def __init__(self, cap=NOTIF_MEMORY_LIMIT, items=(), backend=None, user=None, total=None):
+        self.items=deque(items,maxlen=cap); self.unread=sum(1 for n in self.items if not n['read'])
+        self.pending=[]; self.read_all=False; self.backend=backend; self.user=user
+        self.total=len(self.items) if total is None else total
+
+    def __len__(self): return len(self.items)
+    def __iter__(self): return iter(self.items)
+
+    def add(self,n):
+        if len(self.items)==self.items.maxlen and not self.items[-1]['read']: self.unread-=1
+        self.items.appendleft(n); self.pending.append(n); self.total+=1
+        if not n['read']: self.unread+=1
+
+    def mark_read(self):
+        left=self.unread
+        for n in self.items:
+            if not left: break
+            if not n['read']: n['read']=True; left-=1
+        self.unread=0; self.read_all=True
+
+    def page(self,start=0,size=8):
+        out=list(itertools.islice(self.items,start,start+size))
+        if len(out)<size and self.backend and start+len(out)<self.total:
+            seqs=[n['seq'] for n in self.items if 'seq' in n]
+            if seqs and len(seqs)==len(self.items):  # everything in memory is on disk, so page by seq
+                skip=max(0,start-len(self.items))
+                rows=self.backend.load_notifs(self.user,skip+size-len(out),before=seqs[-1])
+                out+=rows[skip:]
+        return out
+
+
+def _digest(obj): return hashlib.sha1(json.dumps(obj,sort_keys=True,default=str).encode()).hexdigest()
+
+def load_progress(user):
+    # Lazy per-user load on login; later runs only flush what changed.
+    if user in st.session_state.persisted: return
+    ps=get_progress_store(); marks={}
+    for kind,src in (('tracker',st.session_state.tracker_data),('xp',st.session_state.xp_data)):
+        doc,v=ps.load_state(user,kind)
+        if doc is not None: src[user]=doc
+        marks[kind]={'digest':_digest(doc) if doc is not None else None,'v':v,'base':copy.deepcopy(doc) or {}}
+    chats=ps.load_chat(user,CHAT_MEMORY_LIMIT)
+    feed=NotificationFeed(NOTIF_MEMORY_LIMIT,ps.load_notifs(user,NOTIF_MEMORY_LIMIT),ps,user,ps.count_notifs(user))
+    for n in getattr(st.session_state.notifications.get(user),'pending',[]): feed.add(n)
+    st.session_state.chat_history[user]=chats; st.session_state.notifications[user]=feed
+    st.session_state.persisted[user]={**marks,'chat_list':id(chats)}
+
+def merge_state(base,mine,theirs):
+    # Three-way merge of this session's edits (base -> mine) into a newer stored copy:
+    # numbers add this session's delta, lists keep both sides' additions and removals,
+    # anything else takes this session's value only where it changed it.
+    if isinstance(mine,dict) and isinstance(theirs,dict):
+        b=base if isinstance(base,dict) else {}
+        return {k:merge_state(b.get(k),mine[k],theirs[k]) if k in mine and k in theirs else mine.get(k,theirs.get(k))
+                for k in {**theirs,**mine} if not (k in b and (k not in mine or k not in theirs))}
+    if mine==base: return theirs
+    if theirs==base: return mine
+    if isinstance(mine,(int,float)) and isinstance(theirs,(int,float)) and not isinstance(mine,bool):
+        return theirs+mine-(base or 0)
+    if isinstance(mine,list) and isinstance(theirs,list):
+        b=base if isinstance(base,list) else []
+        return [x for x in theirs if x in mine or x not in b]+[x for x in mine if x not in b and x not in theirs]
+    return mine
+
+def sync_state(ps,user,kind,doc,mark):
+    # Saves this session's document if it changed and adopts other sessions' saves;
+    # returns True when a new version was written.
+    dg=_digest(doc); v=ps.state_version(user,kind)
+    if v==mark['v'] and dg==mark['digest']: return False
+    if v!=mark['v']:
+        theirs,v=ps.load_state(user,kind)
+        if theirs is not None:
+            if dg==mark['digest']: merged=theirs
+            elif kind=='tracker' and theirs.get('date')!=doc.get('date'): merged=max(doc,theirs,key=lambda d:d.get('date',''))
+            else: merged=merge_state(mark['base'],doc,theirs)
+            if kind=='xp': merged['level']=level_for(merged.get('xp',0))
+            doc.clear(); doc.update(copy.deepcopy(merged)); dg=_digest(doc)
+            if dg==_digest(theirs):
+                mark.update(digest=dg,v=v,base=copy.deepcopy(doc)); return False
+    nv=ps.save_state(user,kind,doc,expect=v)
+    if nv is None: return sync_state(ps,user,kind,doc,mark)  # lost the race again: merge once more
+    mark.update(digest=dg,v=nv,base=copy.deepcopy(doc)); return True
+
+def flush_progress():
+    ps=get_progress_store()
+    for user,mark in st.session_state.persisted.items():
+        for kind,src in (('tracker',st.session_state.tracker_data),('xp',st.session_state.xp_data)):
+            if user in src and sync_state(ps,user,kind,src[user],mark[kind]) and kind=='tracker':
+                ps.record_day(user,src[user].get('date',day_key()),tracker_totals(src[user]))
+
+        chats=st.session_state.chat_history.get(user)
+        if chats is not None:
+            if id(chats)!=mark['chat_list']:
+                ps.clear_chat(user); mark['chat_list']=id(chats)
+            new=[m for m in chats if 'seq' not in m]
+            if new: ps.append_chat(user,new)
+            if len(chats)>CHAT_MEMORY_LIMIT: del chats[:len(chats)-CHAT_MEMORY_LIMIT]
+
+        feed=st.session_state.notifications.get(user)
+        if feed is not None:
+            if feed.read_all: ps.mark_notifs_read(user); feed.read_all=False
+            new,feed.pending=feed.pending,[]
+            if new:
+                ps.append_notifs(user,new)
+                if feed.total>NOTIF_RETENTION:
+                    ps.trim_notifs(user,new[-1]['seq']+1-NOTIF_RETENTION); feed.total=NOTIF_RETENTION
+
+# ═══════════════════════════════════════════════════════════
+#  FOOD DATABASE — bundled CSV compiled into an indexed SQLite catalog
+# ═══════════════════════════════════════════════════════════
+FOODS_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "foods.csv")
+FOODS_DB = "foods.db"
+
+def trigrams(text):
+    text = f" {text} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class FoodDB:
+    # Prefix lookups use the B-tree on name_lc; substring lookups go through a trigram
+    # table, scanning only the rows of the query's rarest trigram.
+    def __init__(self, path=FOODS_DB, csv_path=FOODS_CSV):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS foods (id INTEGER PRIMARY KEY, name TEXT, name_lc TEXT, serving TEXT,"
+                               " calories REAL, protein REAL, carbs REAL, fat REAL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS foods_name ON foods(name_lc)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS food_trigrams (tri TEXT, food_id INTEGER, PRIMARY KEY(tri, food_id)) WITHOUT ROWID")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS trigram_freq (tri TEXT PRIMARY KEY, n INTEGER) WITHOUT ROWID")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        if csv_path and os.path.exists(csv_path):
+            version = str(os.stat(csv_path).st_mtime_ns)
+            with self._lock:
+                row = self._conn.execute("SELECT value FROM meta WHERE key='source_version'").fetchone()
+            if not row or row[0] != version:
+                with open(csv_path, newline="", encoding="utf-8") as f:
+                    self.load_rows(csv.DictReader(f))
+                with self._lock, self._conn:
+                    self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('source_version', ?)", (version,))
+
+    def load_rows(self, rows):
+        foods, tris = [], []
+        for i, r in enumerate(rows, 1):
+            name = r["name"].strip()
+            foods.append((i, name, name.lower(), r.get("serving", ""), float(r["calories"]), float(r["protein"]),
+                          float(r["carbs"]), float(r["fat"])))
+            tris.extend((t, i) for t in trigrams(name.lower()))
+        with self._lock, self._conn:
+            for table in ("foods", "food_trigrams", "trigram_freq"):
+                self._conn.execute(f"DELETE FROM {table}")
+            self._conn.executemany("INSERT INTO foods VALUES (?,?,?,?,?,?,?,?)", foods)
+            self._conn.executemany("INSERT OR IGNORE INTO food_trigrams VALUES (?,?)", tris)
+            self._conn.execute("INSERT INTO trigram_freq SELECT tri, COUNT(*) FROM food_trigrams GROUP BY tri")
+        logger.info("Food catalog loaded: %d items", len(foods))
+
+    def search(self, query, limit=8):
+        q = " ".join(query.lower().split())
+        if not q:
+            return []
+        cols = "id, name, serving, calories, protein, carbs, fat"
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {cols} FROM foods WHERE name_lc >= ? AND name_lc < ? ORDER BY name_lc LIMIT ?",
+                                      (q, q + "\uffff", limit)).fetchall()
+            if len(rows) < limit and len(q) >= 2:
+                # Unpadded, so a half-typed word still matches; two letters match word starts.
+                tris = list({q[i:i + 3] for i in range(len(q) - 2)}) if len(q) >= 3 else [f" {q}"]
+                freq = self._conn.execute(f"SELECT tri, n FROM trigram_freq WHERE tri IN ({','.join('?' * len(tris))})", tris).fetchall()
+                if len(freq) == len(tris):  # a trigram with no rows means no food contains the query
+                    rarest = min(freq, key=lambda f: f[1])[0]
+                    seen = {r[0] for r in rows}
+                    # No ORDER BY: SQLite can stop at the first few hits instead of sorting every match.
+                    more = self._conn.execute(
+                        f"SELECT {cols} FROM food_trigrams t JOIN foods f ON f.id = t.food_id WHERE t.tri = ? AND f.name_lc LIKE ? LIMIT ?",
+                        (rarest, f"%{q}%", limit + len(seen))).fetchall()
+                    more.sort(key=lambda r: (r[1].lower().find(q), r[1].lower()))
+                    rows += [r for r in more if r[0] not in seen][:limit - len(rows)]
+        return [{'id': i, 'name': n, 'serving': sv, 'calories': c, 'protein': p, 'carbs': cb, 'fat': fa}
+                for i, n, sv, c, p, cb, fa in rows]
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM foods").fetchone()[0]
+
+
+@st.cache_resource(show_spinner=False)
+def get_food_db():
+    return FoodDB(get_setting("FOOD_DB", FOODS_DB), get_setting("FOOD_CSV", FOODS_CSV))
 
 # ═══════════════════════════════════════════════════════════
 #  PAGE CONFIG
 # ═══════════════════════════════════════════════════════════
 st.set_page_config(page_title="CoachBot",page_icon="⚡",layout="wide",initial_sidebar_state="expanded")
 
-st.markdown("""
-<style>
-@import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700;800;900&display=swap');
-:root{--primary:#13ecec;--bg:#f0f4f8;--white:#fff;--s900:#0f172a;--s800:#1e293b;--s700:#334155;
-      --s600:#475569;--s500:#64748b;--s400:#94a3b8;--s200:#e2e8f0;--s100:#f1f5f9;}
-*,*::before,*::after{box-sizing:border-box;}
-html,body,[class*="css"]{font-family:'Inter',sans-serif!important;color:var(--s900);}
-.stApp{background:var(--bg);}
-[data-testid="stHeader"],header[data-testid="stHeader"]{display:none!important;}
-footer,#MainMenu{display:none!important;visibility:hidden!important;}
-.block-container{padding:1rem 1.5rem 140px!important;max-width:100%!important;}
-
-/* ── SIDEBAR ── */
-section[data-testid="stSidebar"]{background:var(--white)!important;border-right:1px solid var(--s200)!important;min-width:250px!important;max-width:268px!important;}
-section[data-testid="stSidebar"]>div:first-child{padding:1rem 0.75rem!important;height:100vh;display:flex;flex-direction:column;}
-section[data-testid="stSidebar"][aria-expanded="false"]{min-width:250px!important;max-width:268px!important;}
-section[data-testid="stSidebar"][aria-expanded="false"]{transform:translateX(0)!important;}
-section[data-testid="stSidebar"][aria-expanded="false"]>div{display:flex!important;}
-[data-testid="collapsedControl"]{background:white!important;border:1px solid #e2e8f0!important;border-radius:0 8px 8px 0!important;}
-[data-testid="collapsedControl"]{display:flex!important;opacity:1!important;visibility:visible!important;}
-section[data-testid="stSidebar"] .stButton>button{background:transparent!important;border:none!important;border-radius:.55rem!important;color:var(--s600)!important;font-weight:600!important;text-align:left!important;padding:.55rem .8rem!important;width:100%!important;font-size:.83rem!important;transition:all .15s!important;}
-section[data-testid="stSidebar"] .stButton>button:hover{background:var(--s100)!important;color:var(--s900)!important;}
-section[data-testid="stSidebar"] .stButton>button[kind="primary"]{background:linear-gradient(135deg,#13ecec,#06b6d4)!important;color:#0f172a!important;font-weight:700!important;box-shadow:0 3px 10px rgba(19,236,236,.3)!important;}
-
-/* ── GLOBAL BUTTONS ── */
-.stButton>button{border-radius:.6rem!important;font-weight:700!important;padding:.6rem 1rem!important;width:100%!important;font-size:.875rem!important;transition:all .15s!important;border:2px solid transparent!important;}
-.stButton>button:hover{transform:translateY(-2px)!important;box-shadow:0 4px 12px rgba(0,0,0,.15)!important;}
-.stButton>button[kind="primary"]{background:linear-gradient(135deg,#13ecec,#06b6d4)!important;color:#0f172a!important;border:none!important;box-shadow:0 4px 12px rgba(19,236,236,.3)!important;}
-.stButton>button[kind="primary"]:hover{filter:brightness(1.06);}
-.stButton>button:not([kind="primary"]){background:var(--white)!important;border:1.5px solid var(--s200)!important;color:var(--s700)!important;}
-.stButton>button:not([kind="primary"]):hover{border-color:var(--primary)!important;color:var(--s900)!important;}
-.stButton>button[kind="secondary"]{width:auto!important;padding:.3rem .85rem!important;font-size:.78rem!important;}
-
-/* ── INPUTS ── */
-label,.stTextInput label,.stSelectbox label,.stTextArea label,.stNumberInput label{color:var(--s800)!important;font-weight:600!important;font-size:.8rem!important;-webkit-text-fill-color:var(--s800)!important;}
-input[type="text"],input[type="number"],input[type="password"],textarea{background:var(--white)!important;color:var(--s900)!important;-webkit-text-fill-color:var(--s900)!important;border:1.5px solid var(--s200)!important;border-radius:.5rem!important;font-size:.875rem!important;}
-input:focus,textarea:focus{border-color:var(--primary)!important;box-shadow:0 0 0 3px rgba(19,236,236,.15)!important;outline:none!important;}
-input[type="number"]::-webkit-outer-spin-button,input[type="number"]::-webkit-inner-spin-button{-webkit-appearance:none!important;}
-.stNumberInput [data-testid*="Step"],.stNumberInput button{display:none!important;}
-
-/* ── SELECT ── */
-div[data-baseweb="select"]>div{background:var(--white)!important;border:1.5px solid var(--s200)!important;border-radius:.5rem!important;}
-div[data-baseweb="select"],div[data-baseweb="select"] *{color:var(--s900)!important;-webkit-text-fill-color:var(--s900)!important;background:transparent!important;}
-div[data-baseweb="menu"],div[data-baseweb="popover"],ul[data-baseweb="menu"]{background:var(--white)!important;border:1px solid var(--s200)!important;border-radius:.5rem!important;box-shadow:0 8px 24px rgba(15,23,42,.12)!important;}
-li[role="option"],[data-baseweb="option"]{background:var(--white)!important;color:var(--s900)!important;-webkit-text-fill-color:var(--s900)!important;}
-li[role="option"]:hover,[data-baseweb="option"]:hover{background:#e0fffe!important;}
-li[role="option"][aria-selected="true"]{background:#ccfafa!important;}
-div[data-baseweb="select"] [class*="placeholder"]{color:var(--s400)!important;-webkit-text-fill-color:var(--s400)!important;}
-
-/* ── TABS ── */
-.stTabs [data-baseweb="tab-list"]{gap:1rem;border-bottom:1px solid var(--s200);background:transparent;}
-.stTabs [data-baseweb="tab"]{color:var(--s500)!important;font-weight:600!important;padding:.6rem 0!important;background:transparent!important;}
-.stTabs [aria-selected="true"]{color:var(--s900)!important;border-bottom:2.5px solid var(--primary)!important;background:transparent!important;}
-
-/* ── DASHBOARD ALIGN ── */
-div[data-testid="column"]>div{width:100%!important;}
-
-/* ── CHAT INPUT ── */
-.stChatFloatingInputContainer {
-    background: transparent !important;
-    padding-bottom: 20px !important;
-    bottom: 0 !important;
-}
-[data-testid="stChatInput"] {
-    border-radius: 16px !important;
-    background: #fff !important;
-    border: 2px solid #13ecec !important;
-    box-shadow: 0 4px 12px rgba(19,236,236,.15) !important;
-    transition: all .2s ease !important;
-    margin-bottom: 10px !important;
-}
-[data-testid="stChatInput"]:focus-within {
-    border-color: #13ecec !important;
-    box-shadow: 0 6px 20px rgba(19,236,236,.25) !important;
-}
-[data-testid="stChatInput"] textarea {
-    background: #fff !important;
-    border: none !important;
-    color: #0f172a !important;
-    -webkit-text-fill-color: #0f172a !important;
-    font-size: .95rem !important;
-    font-weight: 500 !important;
-}
-[data-testid="stChatInput"] textarea::placeholder {
-    color: #94a3b8 !important;
-    -webkit-text-fill-color: #94a3b8 !important;
-    font-weight: 500 !important;
-}
-[data-testid="stChatInput"] button {
-    background: linear-gradient(135deg,#13ecec,#06b6d4) !important;
-    border: none !important;
-    border-radius: 12px !important;
-    color: #0f172a !important;
-    font-weight: 700 !important;
-    padding: 8px 16px !important;
-    transition: all .2s ease !important;
-}
-[data-testid="stChatInput"] button:hover {
-    filter: brightness(1.1);
-    box-shadow: 0 4px 12px rgba(19,236,236,.3) !important;
-}
-[data-testid="stChatInput"] button svg {
-    fill: #0f172a !important;
-    color: #0f172a !important;
-}
-
-/* ── ALERTS ── */
-div[data-testid="stAlert"] p,div[data-testid="stAlert"] span,div[data-testid="stAlert"] div{color:#0f172a!important;-webkit-text-fill-color:#0f172a!important;font-weight:600!important;}
-
-/* ── BADGES ── */
-.badge{display:inline-flex;align-items:center;gap:4px;padding:2px 9px;border-radius:20px;font-size:.63rem;font-weight:700;white-space:nowrap;}
-.badge-gold{background:#fef3c7;color:#92400e;border:1px solid #fcd34d;}
-.badge-teal{background:#e0fffe;color:#0d9488;border:1px solid #13ecec;}
-.badge-purple{background:#ede9fe;color:#6d28d9;border:1px solid #a78bfa;}
-.badge-green{background:#dcfce7;color:#166534;border:1px solid #86efac;}
-.badge-red{background:#fee2e2;color:#991b1b;border:1px solid #fca5a5;}
-.badge-locked{display:inline-flex;flex-direction:column;align-items:center;gap:6px;background:#f1f5f9;border:2px dashed #cbd5e1;border-radius:10px;padding:10px;text-align:center;opacity:0.65;filter:grayscale(100%);}
-
-/* ── TRACKER INLINE BUTTONS ── */
-div[data-testid="stTabs"] .stButton>button{background:#fff!important;border:2px solid #e2e8f0!important;color:#0f172a!important;-webkit-text-fill-color:#0f172a!important;font-weight:700!important;}
-div[data-testid="stTabs"] .stButton>button:hover{border-color:#13ecec!important;background:#e0fffe!important;color:#0d9488!important;-webkit-text-fill-color:#0d9488!important;}
-
-/* ── CHECKBOX ── */
-.stCheckbox label span,.stCheckbox label p{color:var(--s900)!important;-webkit-text-fill-color:var(--s900)!important;font-weight:600!important;}
-
-/* ── TYPING DOTS ── */
-@keyframes blink{0%,80%,100%{opacity:0}40%{opacity:1}}
-.dot{display:inline-block;width:6px;height:6px;border-radius:50%;background:#0d9488;animation:blink 1.4s infinite ease-in-out;margin:0 2px;}
-.dot:nth-child(2){animation-delay:.2s}.dot:nth-child(3){animation-delay:.4s}
-
-/* ── SIDEBAR TRACKER MINI ── */
-.tracker-mini{background:#ffffff;border-radius:9px;border:2px solid #13ecec;padding:12px 10px;margin-bottom:8px;box-shadow:0 2px 8px rgba(19,236,236,.1);}
-.tracker-mini-row{display:flex;justify-content:space-between;align-items:center;padding:6px 0;border-bottom:1px solid #e2e8f0;font-size:.75rem;}
-.tracker-mini-row:last-child{border-bottom:none;}
-.tm-label{color:#0f172a;font-weight:700;font-size:.73rem;}
-.tm-val{color:#0f172a;font-weight:900;font-size:.8rem;}
-.tm-val.good{color:#22c55e;font-weight:900;}
-.water-bar{height:6px;background:#e2e8f0;border-radius:4px;overflow:hidden;margin-top:4px;border:1px solid #d1d5db;}
-.water-fill{height:100%;background:linear-gradient(90deg,#13ecec,#06b6d4);border-radius:3px;transition:width .3s;}
-</style>
-""", unsafe_allow_html=True)
+load_stylesheet("coachbot.css")
 
 # ═══════════════════════════════════════════════════════════
 #  SESSION STATE
@@ -351,13 +1738,11 @@ for k,v in {
     'page':'login','current_user':None,'login_error':'','signup_error':'',
     'users':{},'tracker_data':{},'show_loading':False,'show_startup':True,
     'show_startup_phase':0,'notifications':{},'chat_history':{},'xp_data':{},
-    'pf_attempt':False,'ai_thinking':False,'tracker_tab':0,
+    'pf_attempt':False,'ai_thinking':False,'tracker_tab':0,'persisted':{},
+    'chat_window':{},'chat_older':{},'chat_older_done':set(),'notif_page':0,
 }.items():
     if k not in st.session_state: st.session_state[k]=v
 
-if not st.session_state.users:
-    st.session_state.users=load_users_from_file()
-
 if st.session_state.show_startup:
     st.markdown("<style>.stApp{background:#0f172a!important;}</style>",unsafe_allow_html=True)
 
@@ -377,29 +1762,56 @@ BADGES_DEF={
 XP_REWARDS={'chat_msg':10,'exercise_done':25,'food_logged':10,'water_500':8,'feedback':30,'login':20}
 LVL_XP=[0,100,250,450,700,1000,1400,1900,2500,3200,4000]
 
+# Declarative badge rules: each badge subscribes to the events that can change its condition,
+# so an event only re-checks those rules. t is the day's tracker totals.
+BADGE_RULES={
+    'first_chat':    (('chat',),    lambda d,t: d.get('chats',0)>=1),
+    'hydration_hero':(('water',),   lambda d,t: t['water']>=2000),
+    'iron_will':     (('exercise',),lambda d,t: d.get('exercises_done',0)>=5),
+    'nutrition_pro': (('meal',),    lambda d,t: d.get('meals_logged',0)>=5),
+    'level_5':       (('level',),   lambda d,t: d['level']>=5),
+    'level_10':      (('level',),   lambda d,t: d['level']>=10),
+    'feedback_giver':(('feedback',),lambda d,t: True),
+    'streak':        (('xp',),      lambda d,t: d['xp']>=200),
+}
+RULES_BY_EVENT={}
+for _bid,(_evs,_) in BADGE_RULES.items():
+    for _ev in _evs: RULES_BY_EVENT.setdefault(_ev,[]).append(_bid)
+EVENT_COUNTERS={'chat':'chats','meal':'meals_logged','exercise':'exercises_done'}
+
 def get_xp(user):
-    return st.session_state.xp_data.setdefault(user,{'xp':0,'level':1,'badges':[],'meals_logged':0,'exercises_done':0})
+    d=st.session_state.xp_data.setdefault(user,{'xp':0,'level':1,'badges':[],'meals_logged':0,'exercises_done':0})
+    if 'chats' not in d: d['chats']=sum(1 for m in st.session_state.chat_history.get(user,[]) if m['role']=='user')
+    return d
+
+def level_for(xp): return bisect.bisect_right(LVL_XP,xp)
+
+def fire(user,*events):
+    # Evaluates only the rules subscribed to these events; returns the newly earned badge ids.
+    d=get_xp(user); earned=d.setdefault('badges',[]); new=[]
+    bids=[b for b in dict.fromkeys(b for ev in events for b in RULES_BY_EVENT.get(ev,())) if b not in earned]
+    if not bids: return new
+    tr=st.session_state.tracker_data.get(user)
+    t=tracker_totals(tr) if tr else dict.fromkeys(TOTAL_KEYS,0)
+    for bid in bids:
+        if BADGE_RULES[bid][1](d,t):
+            earned.append(bid); new.append(bid); b=BADGES_DEF[bid]
+            add_notif(user,f"{b[0]} Badge: **{b[1]}** — {b[2]}","success")
+    return new
+
+def _gain(d,pts):
+    d['xp']+=pts; lvl=level_for(d['xp'])
+    if lvl==d['level']: return ('xp',)
+    d['level']=lvl; return ('xp','level')
 
 def award_xp(user,action,pts=None):
-    d=get_xp(user); p=pts if pts is not None else XP_REWARDS.get(action,0); d['xp']+=p
-    for i,t in enumerate(LVL_XP):
-        if d['xp']>=t: old=d['level']; d['level']=i+1
-    _check_badges(user,d); return p
-
-def _check_badges(user,d):
-    earned=d.setdefault('badges',[])
-    def g(bid):
-        if bid not in earned:
-            earned.append(bid); b=BADGES_DEF[bid]
-            add_notif(user,f"{b[0]} Badge: **{b[1]}** — {b[2]}","success")
-    if len(st.session_state.chat_history.get(user,[]))>=1: g('first_chat')
-    if d.get('exercises_done',0)>=5: g('iron_will')
-    if d.get('meals_logged',0)>=5:   g('nutrition_pro')
-    if d['level']>=5:  g('level_5')
-    if d['level']>=10: g('level_10')
-    if d['xp']>=200:   g('streak')
-    tr=st.session_state.tracker_data.get(user,{})
-    if tr.get('water',0)>=2000: g('hydration_hero')
+    d=get_xp(user); p=pts if pts is not None else XP_REWARDS.get(action,0)
+    fire(user,*_gain(d,p)); return p
+
+def record_event(user,event,n=1):
+    d=get_xp(user); c=EVENT_COUNTERS.get(event)
+    if c: d[c]=d.get(c,0)+n
+    return fire(user,event)
 
 def xp_bar(user):
     d=get_xp(user); lo=LVL_XP[min(d['level']-1,len(LVL_XP)-1)]; hi=LVL_XP[min(d['level'],len(LVL_XP)-1)]
@@ -431,25 +1843,83 @@ DEFAULT_EX=[
 ]
 
 def navigate_to(page): st.session_state.page=page; st.rerun()
+def notif_feed(user):
+    feed=st.session_state.notifications.get(user)
+    if feed is None: feed=st.session_state.notifications[user]=NotificationFeed(NOTIF_MEMORY_LIMIT)
+    return feed
 def add_notif(user,msg,typ="info"):
-    st.session_state.notifications.setdefault(user,[]).insert(0,{'msg':msg,'time':datetime.now().strftime("%b %d, %H:%M"),'read':False,'type':typ})
-def unread(user): return sum(1 for n in st.session_state.notifications.get(user,[]) if not n['read'])
-def mark_read(user):
-    for n in st.session_state.notifications.get(user,[]): n['read']=True
+    notif_feed(user).add({'msg':msg,'time':datetime.now().strftime("%b %d, %H:%M"),'read':False,'type':typ})
+def unread(user): return notif_feed(user).unread
+def mark_read(user): notif_feed(user).mark_read()
+def day_key(): return datetime.now().strftime('%Y-%m-%d')
+
 def ensure_tracker(user):
-    if user not in st.session_state.tracker_data:
+    tr=st.session_state.tracker_data.get(user)
+    if tr is None:
         exs=copy.deepcopy(DEFAULT_EX); now_t=datetime.now().strftime("%H:%M")
         for e in exs: e['time']=now_t
-        st.session_state.tracker_data[user]={'food_log':[],'water':0,'exercises':exs}
+        st.session_state.tracker_data[user]=new_tracker(exs)
+    elif tr.setdefault('date',day_key())!=day_key():
+        # First run of a new day: close out yesterday in the history store and start a
+        # fresh tracker that keeps the workout plan, unticked.
+        get_progress_store().record_day(user,tr['date'],tracker_totals(tr))
+        exs=[{**e,'completed':False,'time':''} for e in tr.get('exercises',[])] or copy.deepcopy(DEFAULT_EX)
+        st.session_state.tracker_data[user]=new_tracker(exs)
+
+def new_tracker(exs):
+    return {'date':day_key(),'food_log':[],'exercises':exs,'totals':{**{k:0 for k in TOTAL_KEYS},'ex_total':len(exs)}}
+
+# ═══════════════════════════════════════════════════════════
+#  DAILY TOTALS — one aggregate record per tracker, adjusted in O(1) by each event
+# ═══════════════════════════════════════════════════════════
+TOTAL_KEYS=('calories','protein','carbs','fat','meals','water','ex_done','ex_total','volume')
+
+def ex_volume(e): return e.get('sets',0)*e.get('reps',0)*e.get('weight',0)
+
+def tracker_totals(tr):
+    t=tr.get('totals')
+    if t is None:  # trackers saved before the aggregate existed: build it once
+        food=tr.get('food_log',[]); exs=tr.get('exercises',[]); done=[e for e in exs if e.get('completed')]
+        t=tr['totals']={**{k:sum(e.get(k,0) for e in food) for k in ('calories','protein','carbs','fat')},
+                        'meals':len(food),'water':tr.pop('water',0),'ex_done':len(done),'ex_total':len(exs),
+                        'volume':sum(ex_volume(e) for e in done)}
+        tr.pop('food_totals',None)
+    return t
+
+def add_food(tr,entry):
+    t=tracker_totals(tr); tr['food_log'].append(entry); t['meals']+=1
+    for k in ('calories','protein','carbs','fat'): t[k]+=entry.get(k,0)
+
+def remove_food(tr,i):
+    t=tracker_totals(tr); entry=tr['food_log'].pop(i); t['meals']-=1
+    for k in ('calories','protein','carbs','fat'): t[k]-=entry.get(k,0)
+
+def add_water(tr,ml): tracker_totals(tr)['water']+=ml
+def reset_water(tr): tracker_totals(tr)['water']=0
+
+def add_exercise(tr,ex):
+    t=tracker_totals(tr); tr['exercises'].append(ex); t['ex_total']+=1
+
+def complete_exercise(tr,ex):
+    t=tracker_totals(tr); ex['completed']=True; t['ex_done']+=1; t['volume']+=ex_volume(ex)
+
+def remove_exercise(tr,i):
+    t=tracker_totals(tr); ex=tr['exercises'].pop(i); t['ex_total']-=1
+    if ex.get('completed'): t['ex_done']-=1; t['volume']-=ex_volume(ex)
 
 # ═══════════════════════════════════════════════════════════
 #  AUTH
 # ═══════════════════════════════════════════════════════════
 def submit_login():
     u=st.session_state.get('login_username','').strip(); p=st.session_state.get('login_password','')
-    ud=st.session_state.users.get(u)
-    if ud and verify_password(ud.get('password',''),p):
-        st.session_state.current_user=u; st.session_state.login_error=''; st.session_state.show_loading=True
+    ud=get_user(u,refresh=True) if u else None
+    if ud and check_password(ud.get('password',''),p):
+        st.session_state.current_user=u; st.session_state.login_error=''
+        if needs_rehash(ud.get('password')): ud['password']=make_password(p); save_user(u)
+        load_progress(u)
+        if client_side_startup():
+            st.session_state.page='dashboard'; st.session_state.loading_overlay=True; warm_gemini_connection()
+        else: st.session_state.show_loading=True
         d=get_xp(u); today=datetime.now().strftime('%Y-%m-%d')
         if d.get('last_login')!=today: d['last_login']=today; award_xp(u,'login')
     else: st.session_state.login_error="Invalid username or password."
@@ -460,15 +1930,155 @@ def submit_signup():
     cf=st.session_state.get('signup_confirm','')
     if not all([fn,un,em,pw,cf]): st.session_state.signup_error="All fields required."; return
     if pw!=cf: st.session_state.signup_error="Passwords don't match."; return
-    if un in st.session_state.users: st.session_state.signup_error="Username taken."; return
-    st.session_state.users[un]={'password':hash_password(pw),'fullname':fn,'email':em,'profile':{}}
-    save_users_to_file(st.session_state.users)
+    rec={'password':make_password(pw),'fullname':fn,'email':em,'profile':{}}
+    if not get_user_directory().create(un,rec): st.session_state.signup_error="Username taken."; return
+    st.session_state.users[un]=rec; load_progress(un)
     st.session_state.current_user=un; st.session_state.signup_error=''; st.session_state.page='onboarding'
 
 # ═══════════════════════════════════════════════════════════
 #  SIDEBAR  — with inline tracker panel
 # ═══════════════════════════════════════════════════════════
-def sidebar(active):
+def xp_marks(user):
+    d=get_xp(user); return d['level'],len(d.get('badges',[]))
+
+def tap(user,action,*args):
+    # on_click for every tracker control. Callbacks run before live_panels redraws, so a
+    # single fragment run already shows the change everywhere; a level-up or a new badge
+    # also changes panels outside the fragment and asks for a full rerun instead.
+    before=xp_marks(user); action(user,*args)
+    st.session_state.panels_changed="full" if xp_marks(user)!=before else "fragment"
+
+# Every number a tracker tap changes (XP bar, sidebar totals, badges/notifications, the
+# tracker page, the chat page's level card) is drawn by this one fragment, into slots the
+# page reserved for it, so a tap redraws just those slots instead of the whole script.
+@st.fragment
+def live_panels(user,panels,body=None):
+    change=st.session_state.pop('panels_changed',None); ctx=get_script_run_ctx()
+    if change and ctx and ctx.fragment_ids_this_run:
+        if change=="full": st.rerun()
+        # Fragment reruns skip the router's finally, so persist here.
+        try: flush_progress()
+        except Exception as e: logger.error("Progress flush failed: %s", e)
+    for slot,draw in panels:
+        with slot: draw(user)
+    if body: body(user)
+
+def log_water(user,ml):
+    add_water(st.session_state.tracker_data[user],ml); award_xp(user,'water_500',ml//60); record_event(user,'water')
+
+def log_exercise_done(user,i):
+    # By index into the current tracker: a merge with another tab may have replaced it since render.
+    tr=st.session_state.tracker_data[user]; ex=tr['exercises'][i]
+    if ex.get('completed'): return
+    complete_exercise(tr,ex); pts=award_xp(user,'exercise_done')
+    record_event(user,'exercise'); add_notif(user,f"✅ +{pts} XP — {ex['name']}")
+
+def drop_food(user,i): remove_food(st.session_state.tracker_data[user],i)
+def drop_exercise(user,i): remove_exercise(st.session_state.tracker_data[user],i)
+def clear_water(user): reset_water(st.session_state.tracker_data[user])
+
+def log_food(user):
+    ss=st.session_state; fn=ss.food_name
+    if not fn.strip(): return
+    add_food(ss.tracker_data[user],{'name':fn,'calories':ss.food_cal,'protein':ss.food_pro,'carbs':ss.food_crb,
+                                    'fat':ss.food_fat,'time':datetime.now().strftime("%H:%M")})
+    pts=award_xp(user,'food_logged'); record_event(user,'meal')
+    add_notif(user,f"🍎 +{pts} XP — {fn} ({ss.food_cal} kcal)")
+
+def log_exercise(user):
+    ss=st.session_state; en=ss.ex_name
+    if not en.strip(): return
+    add_exercise(ss.tracker_data[user],{'name':en,'sets':ss.ex_sets,'reps':ss.ex_reps,'weight':ss.ex_wt,'notes':ss.ex_notes,
+                                        'completed':False,'time':datetime.now().strftime("%H:%M")})
+    add_notif(user,f"🏋️ Added: {en} ({ss.ex_sets}×{ss.ex_reps})")
+
+def sidebar_xp(user):
+    st.markdown(xp_bar(user),unsafe_allow_html=True)
+
+def sidebar_tracker(user,active):
+    tr=st.session_state.tracker_data.get(user,{})
+    t=tracker_totals(tr); exs=tr.get('exercises',[])
+    water=t['water']; done_ex=t['ex_done']; total_cal=t['calories']
+    water_pct=min(int(water/3000*100),100)
+    water_col="#22c55e" if water_pct>=100 else "#13ecec" if water_pct>=50 else "#f59e0b"
+
+    # Water quick-add buttons
+    st.markdown(f"""<div class="tracker-mini">
+      <div class="tracker-mini-row">
+        <span class="tm-label">💧 Water</span>
+        <span class="tm-val {'good' if water_pct>=100 else ''}">{water}ml</span>
+      </div>
+      <div class="water-bar"><div class="water-fill" style="width:{water_pct}%;background:{water_col};"></div></div>
+      <div style="font-size:.6rem;color:#94a3b8;margin-top:2px;">{water_pct}% of 3000ml goal</div>
+    </div>""",unsafe_allow_html=True)
+
+    # Water quick-add (2x2 buttons for better number visibility)
+    wc1,wc2=st.columns(2)
+    with wc1: st.button("+150ml",key=f"sbw150_{active}",use_container_width=True,on_click=tap,args=(user,log_water,150))
+    with wc2: st.button("+250ml",key=f"sbw250_{active}",use_container_width=True,on_click=tap,args=(user,log_water,250))
+    wc3,wc4=st.columns(2)
+    with wc3: st.button("+500ml",key=f"sbw500_{active}",use_container_width=True,on_click=tap,args=(user,log_water,500))
+    with wc4: st.button("+750ml",key=f"sbw750_{active}",use_container_width=True,on_click=tap,args=(user,log_water,750))
+
+    # Exercise + calories summary
+    st.markdown(f"""<div class="tracker-mini" style="margin-top:6px;">
+      <div class="tracker-mini-row">
+        <span class="tm-label">🏋️ Exercises</span>
+        <span class="tm-val {'good' if done_ex==t['ex_total'] and t['ex_total']>0 else ''}">{done_ex}/{t['ex_total']}</span>
+      </div>
+      <div class="tracker-mini-row">
+        <span class="tm-label">🍎 Meals</span>
+        <span class="tm-val">{t['meals']}</span>
+      </div>
+      <div class="tracker-mini-row" style="border-bottom:none;">
+        <span class="tm-label">🔥 Calories</span>
+        <span class="tm-val">{total_cal} kcal</span>
+      </div>
+    </div>""",unsafe_allow_html=True)
+
+    # Quick complete next exercise
+    i=next((i for i,e in enumerate(exs) if not e.get('completed')),None) if done_ex<t['ex_total'] else None
+    if i is not None:
+        ex=exs[i]
+        st.markdown(f"""<div style="font-size:.65rem;color:#64748b;margin:4px 0 3px;">
+          Next: <strong style="color:#0f172a;">{ex['name']}</strong> {ex['sets']}×{ex['reps']}</div>""",unsafe_allow_html=True)
+        st.button("✓ Mark Done",key=f"sbex_{active}",use_container_width=True, help="Mark this exercise as completed and earn XP",
+                  on_click=tap,args=(user,log_exercise_done,i))
+
+def sidebar_notifs(user):
+    # Badges
+    earned=get_xp(user).get('badges',[])
+    if earned:
+        st.markdown("<div style='font-size:.58rem;font-weight:700;text-transform:uppercase;color:#94a3b8;margin-bottom:4px;'>🏆 BADGES</div>",unsafe_allow_html=True)
+        bhtml=" ".join(f"<span class='badge badge-{BADGES_DEF[b][3]}' title='{BADGES_DEF[b][2]}'>{BADGES_DEF[b][0]}</span>" for b in earned[:6])
+        st.markdown(f"<div style='display:flex;flex-wrap:wrap;gap:3px;margin-bottom:6px;'>{bhtml}</div>",unsafe_allow_html=True)
+
+    # Recent notifs
+    notifs=notif_feed(user).page(0,2)
+    if notifs:
+        st.markdown("<div style='font-size:.58rem;font-weight:700;text-transform:uppercase;color:#94a3b8;margin-bottom:4px;'>🔔 RECENT</div>",unsafe_allow_html=True)
+        for n in notifs:
+            dot="🔵" if not n['read'] else "⚫"; bg="#f0fefe" if not n['read'] else "#f8fafc"
+            st.markdown(f"""<div style="font-size:.68rem;color:#475569;padding:3px 6px;background:{bg};
+                border-radius:5px;margin-bottom:3px;border-left:2px solid {'#13ecec' if not n['read'] else '#e2e8f0'};">
+              {dot} {n['msg'][:45]}{'…' if len(n['msg'])>45 else ''}
+              <div style="font-size:.56rem;color:#94a3b8;">{n['time']}</div>
+            </div>""",unsafe_allow_html=True)
+
+def sidebar_nav(user,active):
+    badge=unread(user)
+    nav_items=[("💬  Chat","dashboard"),("📊  Tracker","tracker"),("📈  Progress","analytics"),
+               ("⭐  Feedback","feedback"),("⚙️  Settings","settings")]
+    for lbl,pg in nav_items:
+        label=lbl+(f"  🔴{badge}" if pg=="dashboard" and badge>0 else "")
+        kind="primary" if active==pg else "secondary"
+        if st.button(label,key=f"sb_{pg}_{active}",use_container_width=True,type=kind):
+            if pg=="dashboard": mark_read(user)
+            navigate_to(pg)
+
+def sidebar(active,live=True):
+    # Returns the (slot, draw) panels for live_panels; pages that add slots of their own
+    # pass live=False and start live_panels themselves once those slots exist.
     user=st.session_state.current_user
     if not user or user not in st.session_state.users:
         st.session_state.current_user=None; navigate_to("login"); return
@@ -476,14 +2086,7 @@ def sidebar(active):
     ud=st.session_state.users[user]; prof=ud.get('profile') or {}
     name=prof.get('fullname',ud.get('fullname',user)); sport=prof.get('sport','Athlete')
     pos=prof.get('position',''); av=(name[0] if name else 'A').upper()
-    badge=unread(user); d=get_xp(user)
     sport_line=f"🏅 {sport} · {pos}" if pos and 'Individual' not in pos else f"🏅 {sport}"
-    tr=st.session_state.tracker_data.get(user,{})
-    water=tr.get('water',0); exs=tr.get('exercises',[]); food=tr.get('food_log',[])
-    done_ex=sum(1 for e in exs if e.get('completed'))
-    total_cal=sum(e.get('calories',0) for e in food)
-    water_pct=min(int(water/3000*100),100)
-    water_col="#22c55e" if water_pct>=100 else "#13ecec" if water_pct>=50 else "#f59e0b"
 
     with st.sidebar:
         # Brand
@@ -502,19 +2105,13 @@ def sidebar(active):
             <div style="font-weight:700;color:#0f172a;font-size:.81rem;white-space:nowrap;overflow:hidden;text-overflow:ellipsis;">{name}</div>
             <div style="font-size:.63rem;color:#64748b;white-space:nowrap;overflow:hidden;text-overflow:ellipsis;">{sport_line}</div>
           </div>
-        </div>{xp_bar(user)}""",unsafe_allow_html=True)
+        </div>""",unsafe_allow_html=True)
+        panels=[(st.container(),sidebar_xp)]
 
         st.markdown("<div style='height:5px;'></div>",unsafe_allow_html=True)
 
-        # ── NAV BUTTONS ──
-        nav_items=[("💬  Chat","dashboard"),("📊  Tracker","tracker"),
-                   ("⭐  Feedback","feedback"),("⚙️  Settings","settings")]
-        for lbl,pg in nav_items:
-            label=lbl+(f"  🔴{badge}" if pg=="dashboard" and badge>0 else "")
-            kind="primary" if active==pg else "secondary"
-            if st.button(label,key=f"sb_{pg}_{active}",use_container_width=True,type=kind):
-                if pg=="dashboard": mark_read(user)
-                navigate_to(pg)
+        # ── NAV BUTTONS ── (live: the chat button carries the unread count)
+        panels.append((st.container(),lambda u:sidebar_nav(u,active)))
 
         # ── DIVIDER ──
         st.markdown("<hr style='border:none;border-top:1px solid #e2e8f0;margin:8px 0 6px;'>",unsafe_allow_html=True)
@@ -522,90 +2119,18 @@ def sidebar(active):
         # ── TRACKER MINI-PANEL (always visible in sidebar) ──
         st.markdown("""<div style="font-size:.6rem;font-weight:700;text-transform:uppercase;
             letter-spacing:.1em;color:#94a3b8;margin-bottom:5px;">📊 TODAY'S TRACKER</div>""",unsafe_allow_html=True)
-
-        # Water quick-add buttons
-        st.markdown(f"""<div class="tracker-mini">
-          <div class="tracker-mini-row">
-            <span class="tm-label">💧 Water</span>
-            <span class="tm-val {'good' if water_pct>=100 else ''}">{water}ml</span>
-          </div>
-          <div class="water-bar"><div class="water-fill" style="width:{water_pct}%;background:{water_col};"></div></div>
-          <div style="font-size:.6rem;color:#94a3b8;margin-top:2px;">{water_pct}% of 3000ml goal</div>
-        </div>""",unsafe_allow_html=True)
-
-        # Water quick-add (2x2 buttons for better number visibility)
-        wc1,wc2=st.columns(2)
-        with wc1:
-            if st.button("+150ml",key=f"sbw150_{active}",use_container_width=True):
-                tr['water']+=150; award_xp(user,'water_500',150//60)
-                _check_badges(user,get_xp(user)); st.rerun()
-        with wc2:
-            if st.button("+250ml",key=f"sbw250_{active}",use_container_width=True):
-                tr['water']+=250; award_xp(user,'water_500',250//60)
-                _check_badges(user,get_xp(user)); st.rerun()
-        wc3,wc4=st.columns(2)
-        with wc3:
-            if st.button("+500ml",key=f"sbw500_{active}",use_container_width=True):
-                tr['water']+=500; award_xp(user,'water_500',500//60)
-                _check_badges(user,get_xp(user)); st.rerun()
-        with wc4:
-            if st.button("+750ml",key=f"sbw750_{active}",use_container_width=True):
-                tr['water']+=750; award_xp(user,'water_500',750//60)
-                _check_badges(user,get_xp(user)); st.rerun()
-
-        # Exercise + calories summary
-        st.markdown(f"""<div class="tracker-mini" style="margin-top:6px;">
-          <div class="tracker-mini-row">
-            <span class="tm-label">🏋️ Exercises</span>
-            <span class="tm-val {'good' if done_ex==len(exs) and len(exs)>0 else ''}">{done_ex}/{len(exs)}</span>
-          </div>
-          <div class="tracker-mini-row">
-            <span class="tm-label">🍎 Meals</span>
-            <span class="tm-val">{len(food)}</span>
-          </div>
-          <div class="tracker-mini-row" style="border-bottom:none;">
-            <span class="tm-label">🔥 Calories</span>
-            <span class="tm-val">{total_cal} kcal</span>
-          </div>
-        </div>""",unsafe_allow_html=True)
-
-        # Quick complete next exercise
-        next_ex=[e for e in exs if not e.get('completed')]
-        if next_ex:
-            ex=next_ex[0]
-            st.markdown(f"""<div style="font-size:.65rem;color:#64748b;margin:4px 0 3px;">
-              Next: <strong style="color:#0f172a;">{ex['name']}</strong> {ex['sets']}×{ex['reps']}</div>""",unsafe_allow_html=True)
-            if st.button("✓ Mark Done",key=f"sbex_{active}",use_container_width=True, help="Mark this exercise as completed and earn XP"):
-                ex['completed']=True; pts=award_xp(user,'exercise_done')
-                d2=get_xp(user); d2['exercises_done']=d2.get('exercises_done',0)+1
-                _check_badges(user,d2); add_notif(user,f"✅ +{pts} XP — {ex['name']}"); st.rerun()
+        panels.append((st.container(),lambda u:sidebar_tracker(u,active)))
 
         # ── DIVIDER ──
         st.markdown("<hr style='border:none;border-top:1px solid #e2e8f0;margin:8px 0 5px;'>",unsafe_allow_html=True)
-
-        # Badges
-        earned=d.get('badges',[])
-        if earned:
-            st.markdown("<div style='font-size:.58rem;font-weight:700;text-transform:uppercase;color:#94a3b8;margin-bottom:4px;'>🏆 BADGES</div>",unsafe_allow_html=True)
-            bhtml=" ".join(f"<span class='badge badge-{BADGES_DEF[b][3]}' title='{BADGES_DEF[b][2]}'>{BADGES_DEF[b][0]}</span>" for b in earned[:6])
-            st.markdown(f"<div style='display:flex;flex-wrap:wrap;gap:3px;margin-bottom:6px;'>{bhtml}</div>",unsafe_allow_html=True)
-
-        # Recent notifs
-        notifs=st.session_state.notifications.get(user,[])
-        if notifs:
-            st.markdown("<div style='font-size:.58rem;font-weight:700;text-transform:uppercase;color:#94a3b8;margin-bottom:4px;'>🔔 RECENT</div>",unsafe_allow_html=True)
-            for n in notifs[:2]:
-                dot="🔵" if not n['read'] else "⚫"; bg="#f0fefe" if not n['read'] else "#f8fafc"
-                st.markdown(f"""<div style="font-size:.68rem;color:#475569;padding:3px 6px;background:{bg};
-                    border-radius:5px;margin-bottom:3px;border-left:2px solid {'#13ecec' if not n['read'] else '#e2e8f0'};">
-                  {dot} {n['msg'][:45]}{'…' if len(n['msg'])>45 else ''}
-                  <div style="font-size:.56rem;color:#94a3b8;">{n['time']}</div>
-                </div>""",unsafe_allow_html=True)
+        panels.append((st.container(),sidebar_notifs))
 
         st.markdown("<div style='flex:1;'></div>",unsafe_allow_html=True)
         st.markdown("<hr style='border:none;border-top:1px solid #e2e8f0;margin:4px 0;'>",unsafe_allow_html=True)
         if st.button("🚪  Logout",key=f"sb_out_{active}",use_container_width=True):
             st.session_state.current_user=None; navigate_to("login")
+        if live: live_panels(user,panels)
+    return panels
 
 # ═══════════════════════════════════════════════════════════
 #  PAGE HEADER
@@ -621,7 +2146,41 @@ def ph(title,sub=None,back=None):
 # ═══════════════════════════════════════════════════════════
 #  LOGIN
 # ═══════════════════════════════════════════════════════════
+def client_side_startup():
+    return str(get_setting("STARTUP_MODE","client")).lower()!="blocking"
+
+# Splash/loading overlays animated purely in CSS: the browser plays them while the
+# server has already moved on to rendering the next page underneath.
+def startup_overlay(title,subtitle,seconds,logo_size=88,title_size="2.4rem"):
+    st.markdown(f"""<div style="position:fixed;inset:0;background:linear-gradient(135deg,#0f172a,#1e293b);
+        display:flex;align-items:center;justify-content:center;z-index:10001;
+        animation:cbfade .35s ease {seconds}s forwards;">
+      <div style="text-align:center;">{LOGO.format(s=logo_size)}
+        <h1 style="font-size:{title_size};font-weight:900;color:#fff;margin:1rem 0 .5rem;">{title}</h1>
+        <p style="color:#13ecec;font-size:.95rem;margin-bottom:2rem;">{subtitle}</p>
+        <div style="width:260px;height:5px;background:rgba(255,255,255,.12);border-radius:3px;overflow:hidden;margin:0 auto;">
+          <div style="width:0;height:100%;background:#13ecec;border-radius:3px;animation:cbfill {seconds}s ease forwards;"></div></div>
+      </div></div>
+<style>@keyframes cbfill{{from{{width:0%}}to{{width:100%}}}}
+@keyframes cbfade{{to{{opacity:0;visibility:hidden;}}}}</style>""",unsafe_allow_html=True)
+
+def warm_gemini_connection():
+    # Opens a pooled TLS connection while the loading overlay plays, so the first chat
+    # message does not pay for the handshake. Runs at most once a minute per process.
+    client=get_gemini_client(); key=get_gemini_key()
+    if not key or time.time()-client.warmed_at<60: return
+    client.warmed_at=time.time()
+    base=str(get_setting("GEMINI_API_BASE","https://generativelanguage.googleapis.com")).rstrip("/")
+    def _warm():
+        try: client.session.get(f"{base}/v1beta/models/{GEMINI_MODEL}?key={key}",timeout=(5,10)).close()
+        except requests.exceptions.RequestException: pass
+    threading.Thread(target=_warm,daemon=True).start()
+
 def login_screen():
+    if st.session_state.show_startup and st.session_state.show_startup_phase==0 and client_side_startup():
+        startup_overlay("Next Gen Sports Lab","Powered by Gemini AI",0.9)
+        st.session_state.show_startup_phase=1
+
     if st.session_state.show_startup and st.session_state.show_startup_phase==0:
         pl=st.empty()
         for pct in range(0,102,2):
@@ -681,64 +2240,8 @@ def login_screen():
         time.sleep(2.5); st.session_state.show_loading=False; navigate_to("dashboard"); return
 
     login_bg_style = get_startup_bg_style()
-    st.markdown(f"""<style>
-        .stApp, [data-testid="stAppViewContainer"]{{{login_bg_style} background-attachment:fixed!important;}}
-        [data-testid="stAppViewContainer"] > .main{{background:transparent!important;}}
-        .block-container{{padding-top:1.1rem!important;}}
-
-        div[data-testid="stVerticalBlockBorderWrapper"]{{
-            background:linear-gradient(180deg, rgba(255,255,255,.26) 0%, rgba(116,186,255,.20) 55%, rgba(8,19,38,.46) 100%)!important;
-            border:1px solid rgba(255,255,255,.34)!important;
-            border-radius:20px!important;
-            box-shadow:0 18px 45px rgba(2,6,23,.46)!important;
-            backdrop-filter:blur(15px)!important;
-        }}
-
-        .stTabs [data-baseweb="tab-list"]{{border-bottom:1px solid rgba(255,255,255,.25)!important;}}
-        .stTabs [data-baseweb="tab"]{{color:#dbeafe!important;font-weight:700!important;}}
-        .stTabs [aria-selected="true"]{{color:#67e8f9!important;border-bottom:2px solid #13ecec!important;}}
-
-        .stTextInput label, .stTextInput label p, .stTextInput label span{{
-            color:#f1f5f9!important;
-            -webkit-text-fill-color:#f1f5f9!important;
-        }}
-        .stTextInput input, .stTextInput input[type="password"], .stTextInput input[type="text"]{{
-            background:rgba(15,23,42,.55)!important;
-            color:#ffffff!important;
-            -webkit-text-fill-color:#ffffff!important;
-            caret-color:#ffffff!important;
-            border:1.4px solid rgba(191,219,254,.52)!important;
-        }}
-        .stTextInput input::placeholder{{
-            color:#f1f5f9!important;
-            -webkit-text-fill-color:#f1f5f9!important;
-            opacity:1!important;
-        }}
-        .stTextInput input:focus::placeholder,
-        .stTextInput input:active::placeholder,
-        div[data-baseweb="base-input"]:focus-within input::placeholder,
-        div[data-baseweb="input"]:focus-within input::placeholder{{
-            color:transparent!important;
-            -webkit-text-fill-color:transparent!important;
-            opacity:0!important;
-        }}
-
-        .stFormSubmitButton > button,
-        div[data-testid="stFormSubmitButton"] > button,
-        div[data-testid="stFormSubmitButton"] button[kind="primary"],
-        .stFormSubmitButton > button[kind="primary"]{{
-            background:linear-gradient(135deg,#67e8f9,#38bdf8)!important;
-            color:#082f49!important;
-            border:none!important;
-            box-shadow:0 8px 20px rgba(56,189,248,.35)!important;
-            font-weight:800!important;
-        }}
-        .stFormSubmitButton > button:hover,
-        div[data-testid="stFormSubmitButton"] > button:hover{{
-            filter:brightness(1.06)!important;
-            transform:translateY(-1px)!important;
-        }}
-    </style>""",unsafe_allow_html=True)
+    load_stylesheet("login.css")
+    st.markdown(f"""<style>.stApp, [data-testid="stAppViewContainer"]{{{login_bg_style} background-attachment:fixed!important;}}</style>""",unsafe_allow_html=True)
 
     st.markdown(f"""<div style="display:flex;align-items:center;gap:10px;padding:.85rem 1rem;border:1px solid rgba(255,255,255,.34);
         border-radius:14px;background:rgba(15,23,42,.36);backdrop-filter:blur(12px);margin-bottom:.9rem;">
@@ -828,6 +2331,7 @@ def onboarding_screen():
                 'diet':st.session_state.pf_diet,'allergies':st.session_state.pf_alg,
                 'goal':st.session_state.pf_goal,
             }
+            save_user(u)
             ensure_tracker(u)
             st.session_state.pf_attempt=False
             add_notif(u,f"🎉 Welcome, {st.session_state.pf_nm}! Profile saved.","success")
@@ -836,15 +2340,105 @@ def onboarding_screen():
 # ═══════════════════════════════════════════════════════════
 #  DASHBOARD
 # ═══════════════════════════════════════════════════════════
+def bubble_html(role,text,time_str):
+    if role=='user':
+        return f"""<div style="background:#f8fafc;border-left:3px solid #13ecec;border-radius:0 8px 8px 8px;
+            padding:8px 12px;font-size:.84rem;color:#334155;line-height:1.5;">
+          <div style="font-weight:700;color:#0f172a;margin-bottom:2px;">You
+            <span style="font-size:.6rem;color:#94a3b8;font-weight:400;margin-left:4px;">{time_str}</span></div>
+          {text}</div>"""
+    return f"""<div style="background:white;border:1px solid #e2e8f0;border-left:3px solid #0d9488;
+        border-radius:8px 8px 8px 0;padding:8px 12px;font-size:.84rem;color:#334155;line-height:1.5;">
+      <div style="font-weight:700;color:#0d9488;margin-bottom:2px;">🤖 Coach
+        <span style="font-size:.6rem;color:#94a3b8;font-weight:400;margin-left:4px;">{time_str}</span></div>
+      {text}</div>"""
+
+@st.cache_resource(show_spinner=False)
+def _bubble_memo():
+    # Process-wide LRU so finished messages are formatted once, not on every rerun.
+    return functools.lru_cache(maxsize=int(get_setting("CHAT_HTML_CACHE", 4096)))(bubble_html)
+
+def chat_bubble_html(msg):
+    return _bubble_memo()(msg['role'],msg['text'],msg['time'])
+
+CHAT_PAGE=int(get_setting("CHAT_PAGE_SIZE",20))
+
+def visible_chat(user):
+    # Last CHAT_PAGE messages by default; "show older" widens the window, pulling pages
+    # from the progress store once the in-memory history runs out.
+    msgs=st.session_state.chat_older.get(user,[])+st.session_state.chat_history[user]
+    want=st.session_state.chat_window.get(user,CHAT_PAGE)
+    more=len(msgs)>want or bool(msgs and msgs[0].get('seq',0)>0 and user not in st.session_state.chat_older_done)
+    return msgs[-want:],more
+
+def show_older_chat(user):
+    msgs=st.session_state.chat_older.get(user,[])+st.session_state.chat_history[user]
+    want=st.session_state.chat_window.get(user,CHAT_PAGE)+CHAT_PAGE
+    st.session_state.chat_window[user]=want
+    if want>len(msgs) and msgs and 'seq' in msgs[0]:
+        page=get_progress_store().load_chat(user,want-len(msgs),before=msgs[0]['seq'])
+        if len(page)<want-len(msgs): st.session_state.chat_older_done.add(user)
+        st.session_state.chat_older[user]=page+st.session_state.chat_older.get(user,[])
+
+def reset_chat_view(user):
+    st.session_state.chat_older.pop(user,None); st.session_state.chat_window.pop(user,None)
+    st.session_state.chat_older_done.discard(user); get_context_builder().forget(user)
+
+THINKING_HTML="""<div style="background:white;border:1px solid #e2e8f0;border-left:3px solid #0d9488;
+    border-radius:8px;padding:9px 13px;display:inline-block;">
+  <span style="font-size:.8rem;color:#64748b;">🤖 Thinking</span>
+  <span class="dot"></span><span class="dot"></span><span class="dot"></span>
+</div>"""
+
+def finish_reply(user,reply,award=True):
+    st.session_state.chat_history[user].append({'role':'bot','text':reply,'time':datetime.now().strftime("%H:%M")})
+    if award: pts=award_xp(user,'chat_msg'); add_notif(user,f"💬 +{pts} XP for chatting!")
+    st.session_state.ai_thinking=False
+
+def collect_reply(user):
+    # Picks up a finished background job; returns False while it is still running.
+    jobs=get_gemini_jobs(); job=jobs.get(user)
+    if job is not None and not job['future'].done(): return False
+    jobs.pop(user)
+    if job is None: finish_reply(user,"⚠️ The reply was lost. Please ask again.",award=False); return True
+    try: reply=job['future'].result()
+    except Exception as e: reply=f"❌ Error: {str(e)[:100]}"
+    finish_reply(user,reply or "⚠️ Gemini returned an empty response. Please try again.")
+    return True
+
+@st.fragment(run_every=0.5)
+def pending_reply(user):
+    if collect_reply(user): st.rerun()
+    job=get_gemini_jobs().get(user); partial="".join(job['chunks']) if job else ""
+    if partial: st.markdown(bubble_html('bot',partial+" ▌",datetime.now().strftime("%H:%M")),unsafe_allow_html=True)
+    else: st.markdown(THINKING_HTML,unsafe_allow_html=True)
+    if st.button("⏹ Cancel",key="cancel_ai",type="secondary"):
+        get_gemini_jobs().cancel(user); finish_reply(user,"⏹️ Request cancelled.",award=False); st.rerun()
+
+def level_card(user):
+    d=get_xp(user)
+    st.markdown(f"""<p style="font-size:.6rem;font-weight:700;text-transform:uppercase;letter-spacing:.1em;color:#94a3b8;margin-bottom:5px;">SESSION STATS</p>
+        <div style="background:linear-gradient(135deg,#0f172a,#1e293b);border-radius:9px;padding:11px;margin-bottom:8px;">
+          <div style="font-size:.58rem;font-weight:700;text-transform:uppercase;color:#94a3b8;margin-bottom:2px;">YOUR LEVEL</div>
+          <div style="font-size:1.3rem;font-weight:900;color:white;">Level {d['level']}</div>
+          <div style="font-size:.66rem;color:#13ecec;margin-bottom:5px;">{d['xp']} XP total</div>
+          <div style="height:4px;background:rgba(255,255,255,.1);border-radius:2px;overflow:hidden;">
+            <div style="width:{min(int((d['xp']-LVL_XP[min(d['level']-1,len(LVL_XP)-1)])/max(LVL_XP[min(d['level'],len(LVL_XP)-1)]-LVL_XP[min(d['level']-1,len(LVL_XP)-1)],1)*100),100)}%;height:100%;background:#13ecec;border-radius:2px;"></div>
+          </div>
+        </div>""",unsafe_allow_html=True)
+
 def dashboard_screen():
     if not st.session_state.current_user or st.session_state.current_user not in st.session_state.users:
         st.session_state.current_user=None; navigate_to("login"); return
-    sidebar("dashboard")
+    panels=sidebar("dashboard",live=False)
     user=st.session_state.current_user
     st.session_state.chat_history.setdefault(user,[])
     prof=st.session_state.users[user].get('profile') or {}
     sport=prof.get('sport','your sport'); goal=prof.get('goal') or 'Improve Performance'
     name=prof.get('fullname',user); d=get_xp(user)
+    if st.session_state.get('ai_thinking') and async_enabled() and collect_reply(user): st.rerun()
+    if st.session_state.pop('loading_overlay',False):
+        startup_overlay("CoachBot","Setting up your dashboard...",1.2,logo_size=72,title_size="2rem")
 
     if not st.session_state.get(f"tutorial_shown_{user}"):
         @st.dialog("Welcome to Coach Bot! 🚀")
@@ -904,46 +2498,27 @@ def dashboard_screen():
           Ask me anything — drills, nutrition, recovery, strategy! 💪
         </div>""",unsafe_allow_html=True)
 
-        for msg in st.session_state.chat_history[user]:
-            if msg['role']=='user':
-                st.markdown(f"""<div style="background:#f8fafc;border-left:3px solid #13ecec;border-radius:0 8px 8px 8px;
-                    padding:8px 12px;font-size:.84rem;color:#334155;line-height:1.5;">
-                  <div style="font-weight:700;color:#0f172a;margin-bottom:2px;">You
-                    <span style="font-size:.6rem;color:#94a3b8;font-weight:400;margin-left:4px;">{msg['time']}</span></div>
-                  {msg['text']}</div>""",unsafe_allow_html=True)
-            else:
-                st.markdown(f"""<div style="background:white;border:1px solid #e2e8f0;border-left:3px solid #0d9488;
-                    border-radius:8px 8px 8px 0;padding:8px 12px;font-size:.84rem;color:#334155;line-height:1.5;">
-                  <div style="font-weight:700;color:#0d9488;margin-bottom:2px;">🤖 Coach
-                    <span style="font-size:.6rem;color:#94a3b8;font-weight:400;margin-left:4px;">{msg['time']}</span></div>
-                  {msg['text']}</div>""",unsafe_allow_html=True)
+        window,more=visible_chat(user)
+        if more and st.button("⬆ Show older messages",key="older_ch",type="secondary"):
+            show_older_chat(user); st.rerun()
+        for msg in window:
+            st.markdown(chat_bubble_html(msg),unsafe_allow_html=True)
 
+        stream_slot=None
         if st.session_state.get('ai_thinking'):
-            st.markdown("""<div style="background:white;border:1px solid #e2e8f0;border-left:3px solid #0d9488;
-                border-radius:8px;padding:9px 13px;display:inline-block;">
-              <span style="font-size:.8rem;color:#64748b;">🤖 Thinking</span>
-              <span class="dot"></span><span class="dot"></span><span class="dot"></span>
-            </div>""",unsafe_allow_html=True)
+            if async_enabled(): pending_reply(user)
+            else: stream_slot=st.empty(); stream_slot.markdown(THINKING_HTML,unsafe_allow_html=True)
 
         st.markdown("</div></div>",unsafe_allow_html=True)
 
         if st.session_state.chat_history[user]:
             _,mc,_=st.columns([4,1,4])
             with mc:
-                if st.button("🗑️ Clear",key="clr_ch"): st.session_state.chat_history[user]=[]; st.rerun()
+                if st.button("🗑️ Clear",key="clr_ch"): st.session_state.chat_history[user]=[]; reset_chat_view(user); st.rerun()
 
     with col_info:
-        d=get_xp(user)
         chats=st.session_state.chat_history[user]
-        st.markdown(f"""<p style="font-size:.6rem;font-weight:700;text-transform:uppercase;letter-spacing:.1em;color:#94a3b8;margin-bottom:5px;">SESSION STATS</p>
-        <div style="background:linear-gradient(135deg,#0f172a,#1e293b);border-radius:9px;padding:11px;margin-bottom:8px;">
-          <div style="font-size:.58rem;font-weight:700;text-transform:uppercase;color:#94a3b8;margin-bottom:2px;">YOUR LEVEL</div>
-          <div style="font-size:1.3rem;font-weight:900;color:white;">Level {d['level']}</div>
-          <div style="font-size:.66rem;color:#13ecec;margin-bottom:5px;">{d['xp']} XP total</div>
-          <div style="height:4px;background:rgba(255,255,255,.1);border-radius:2px;overflow:hidden;">
-            <div style="width:{min(int((d['xp']-LVL_XP[min(d['level']-1,len(LVL_XP)-1)])/max(LVL_XP[min(d['level'],len(LVL_XP)-1)]-LVL_XP[min(d['level']-1,len(LVL_XP)-1)],1)*100),100)}%;height:100%;background:#13ecec;border-radius:2px;"></div>
-          </div>
-        </div>""",unsafe_allow_html=True)
+        panels.append((st.container(),level_card))
 
         st.markdown("""<p style="font-size:.6rem;font-weight:700;text-transform:uppercase;letter-spacing:.1em;color:#94a3b8;margin-bottom:5px;">RECENT CHATS</p>
         <div style="background:#f8fafc;border-radius:9px;padding:8px;border:1px solid #e2e8f0;margin-bottom:8px;">""",unsafe_allow_html=True)
@@ -962,137 +2537,234 @@ def dashboard_screen():
         st.markdown('<p style="font-size:.6rem;font-weight:700;text-transform:uppercase;letter-spacing:.1em;color:#94a3b8;margin-bottom:5px;">QUICK ACTIONS</p>',unsafe_allow_html=True)
         if st.button("📊 Open Full Tracker",key="qa_tr",use_container_width=True): navigate_to("tracker")
         if st.button("⭐ Give Feedback",key="qa_fb",use_container_width=True): navigate_to("feedback")
+    with st.sidebar: live_panels(user,panels)  # before any blocking Gemini call below
 
     prompt=st.chat_input("Ask your coach anything about your performance...")
     if prompt and not st.session_state.get('ai_thinking'):
         now=datetime.now().strftime("%H:%M")
-        st.session_state.chat_history[user].append({'role':'user','text':prompt,'time':now})
+        history=st.session_state.chat_history[user]
+        history.append({'role':'user','text':prompt,'time':now})
+        record_event(user,'chat')
+        if async_enabled(): get_gemini_jobs().submit(user,prompt,history[:-1],prof,streaming_enabled())
         st.session_state.ai_thinking=True; st.rerun()
 
-    if st.session_state.get('ai_thinking'):
+    if st.session_state.get('ai_thinking') and not async_enabled():
         history=st.session_state.chat_history[user]
         if history and history[-1]['role']=='user':
-            reply=get_ai_response(history[-1]['text'],history[:-1],prof)
-            now=datetime.now().strftime("%H:%M")
-            st.session_state.chat_history[user].append({'role':'bot','text':reply,'time':now})
-            pts=award_xp(user,'chat_msg'); add_notif(user,f"💬 +{pts} XP for chatting!")
+            if streaming_enabled() and stream_slot is not None:
+                reply=""; started=datetime.now().strftime("%H:%M")
+                for chunk in stream_ai_response(history[-1]['text'],history[:-1],prof,user):
+                    reply+=chunk
+                    stream_slot.markdown(bubble_html('bot',reply+" ▌",started),unsafe_allow_html=True)
+                reply=reply.strip() or "⚠️ Gemini returned an empty response. Please try again."
+            else:
+                reply=get_ai_response(history[-1]['text'],history[:-1],prof,user)
+            finish_reply(user,reply)
         st.session_state.ai_thinking=False; st.rerun()
 
 # ═══════════════════════════════════════════════════════════
 #  TRACKER  (full page)
 # ═══════════════════════════════════════════════════════════
-def tracker_screen():
-    if not st.session_state.current_user or st.session_state.current_user not in st.session_state.users:
-        st.session_state.current_user=None; navigate_to("login"); return
-    sidebar("tracker")
-    user=st.session_state.current_user
-    ensure_tracker(user)
+def tracker_summary(user):
     data=st.session_state.tracker_data[user]; d=get_xp(user)
-    ph("Daily Tracker","Log your nutrition, hydration & workouts.",back="dashboard")
-
-    total_cal=sum(e.get('calories',0) for e in data['food_log'])
-    done_ex=sum(1 for e in data['exercises'] if e.get('completed'))
-    water_pct=min(int(data['water']/3000*100),100)
+    t=tracker_totals(data)
+    total_cal=t['calories']; done_ex=t['ex_done']
+    water_pct=min(int(t['water']/3000*100),100)
 
     st.markdown(f"""<div style="display:flex;gap:8px;margin-bottom:1rem;flex-wrap:wrap;">
       <div style="background:white;border-radius:9px;padding:9px 14px;border:1px solid #e2e8f0;flex:1;min-width:80px;text-align:center;">
         <div style="font-size:1.1rem;font-weight:800;color:#0f172a;">{total_cal}</div>
         <div style="font-size:.6rem;color:#64748b;font-weight:600;">🔥 kcal</div></div>
       <div style="background:white;border-radius:9px;padding:9px 14px;border:1px solid {'#22c55e' if water_pct>=100 else '#e2e8f0'};flex:1;min-width:80px;text-align:center;">
-        <div style="font-size:1.1rem;font-weight:800;color:{'#22c55e' if water_pct>=100 else '#0f172a'};">{data['water']}ml</div>
+        <div style="font-size:1.1rem;font-weight:800;color:{'#22c55e' if water_pct>=100 else '#0f172a'};">{t['water']}ml</div>
         <div style="font-size:.6rem;color:#64748b;font-weight:600;">💧 water</div></div>
       <div style="background:white;border-radius:9px;padding:9px 14px;border:1px solid #e2e8f0;flex:1;min-width:80px;text-align:center;">
-        <div style="font-size:1.1rem;font-weight:800;color:#0f172a;">{done_ex}/{len(data['exercises'])}</div>
+        <div style="font-size:1.1rem;font-weight:800;color:#0f172a;">{done_ex}/{t['ex_total']}</div>
         <div style="font-size:.6rem;color:#64748b;font-weight:600;">✅ done</div></div>
       <div style="background:#e0fffe;border-radius:9px;padding:9px 14px;border:1px solid #13ecec;flex:1;min-width:80px;text-align:center;">
         <div style="font-size:1.1rem;font-weight:800;color:#0f172a;">{d['xp']} XP</div>
         <div style="font-size:.6rem;color:#0d9488;font-weight:600;">⚡ Lvl {d['level']}</div></div>
     </div>""",unsafe_allow_html=True)
+    wk=get_progress_store().load_rollups(user,'week',period_key('week',day_key()),period_key('week',day_key()))
+    if wk and wk[0]['days']:
+        w=wk[0]; n=w['days']
+        st.caption(f"📅 This week · {n} day{'s' if n!=1 else ''} tracked · avg {w['calories']/n:.0f} kcal · "
+                   f"{w['water']/n:.0f} ml water/day · {w['ex_done']:.0f} exercises · {w['volume']:.0f} kg volume")
+
+def autofill_food(matches):
+    pick=st.session_state.get('food_pick')
+    if pick is None: return
+    f=matches[pick]
+    st.session_state.food_name=f['name']; st.session_state.food_cal=round(f['calories'])
+    st.session_state.food_pro=round(f['protein']); st.session_state.food_crb=round(f['carbs']); st.session_state.food_fat=round(f['fat'])
+
+def food_tab(user):
+    data=st.session_state.tracker_data[user]
+    for k,v in (('food_name',''),('food_cal',0),('food_pro',0),('food_crb',0),('food_fat',0)): st.session_state.setdefault(k,v)
+    q=st.text_input("🔎 Search food database",key="food_q",placeholder="e.g. chicken, oats, banana")
+    matches=get_food_db().search(q) if q.strip() else []
+    if matches:
+        st.selectbox("Matches",range(len(matches)),index=None,key="food_pick",placeholder="Pick a food to fill in its macros",
+                     format_func=lambda i:f"{matches[i]['name']} · {matches[i]['serving']} · {matches[i]['calories']:.0f} kcal",
+                     on_change=autofill_food,args=(matches,))
+    elif q.strip(): st.caption("No matches — enter the food manually below.")
+    with st.form("food_f"):
+        st.markdown("""<div style='margin:6px 0 10px;padding:8px 10px;background:#f8fafc;border:1px solid #e2e8f0;border-radius:8px;'>
+          <span style='font-size:.86rem;font-weight:800;color:#0f172a;'>Add Food Entry</span>
+        </div>""", unsafe_allow_html=True)
+        st.text_input("Food item",placeholder="e.g. Grilled Chicken",key="food_name")
+        c1,c2,c3,c4=st.columns(4)
+        with c1: st.number_input("Calories",min_value=0,step=10,key="food_cal")
+        with c2: st.number_input("Protein g",min_value=0,step=1,key="food_pro")
+        with c3: st.number_input("Carbs g",min_value=0,step=1,key="food_crb")
+        with c4: st.number_input("Fat g",min_value=0,step=1,key="food_fat")
+        st.form_submit_button("➕ Add Food",type="primary",use_container_width=True,on_click=tap,args=(user,log_food))
+    if data['food_log']:
+        for i,e in enumerate(data['food_log']):
+            ca,cb=st.columns([5,1])
+            with ca:
+                st.markdown(f"""<div style="background:white;border-radius:7px;padding:8px 12px;border:1px solid #e2e8f0;margin-bottom:4px;font-size:.82rem;color:#334155;">
+                  <strong style="color:#0f172a;">{e['time']}</strong> · {e['name']}
+                  <span style="float:right;color:#64748b;font-size:.72rem;">{e['calories']} kcal · P:{e['protein']}g C:{e['carbs']}g F:{e['fat']}g</span>
+                </div>""",unsafe_allow_html=True)
+            with cb:
+                st.button("🗑️",key=f"df{i}",on_click=tap,args=(user,drop_food,i))
+    else: st.info("No food entries yet.")
+
+def water_tab(user):
+    data=st.session_state.tracker_data[user]
+    water=tracker_totals(data)['water']; goal_w=3000; pct=min(water/goal_w,1.0)
+    col2="#22c55e" if pct>=1 else "#13ecec" if pct>=0.5 else "#f59e0b"
+    st.markdown(f"""<div style="text-align:center;margin:.8rem 0 1.2rem;">
+      <div style="font-size:3rem;font-weight:900;color:{col2};">{water}</div>
+      <div style="color:#64748b;font-size:.88rem;font-weight:600;">ml of {goal_w}ml goal</div>
+      <div style="margin:10px auto;width:100%;max-width:320px;height:10px;background:#e2e8f0;border-radius:5px;overflow:hidden;">
+        <div style="width:{int(pct*100)}%;height:100%;background:{col2};border-radius:5px;"></div></div>
+      <div style="font-size:.75rem;color:#64748b;">{int(pct*100)}% of daily goal</div>
+    </div>""",unsafe_allow_html=True)
+    c1,c2,c3,c4=st.columns(4)
+    for cw,amt in zip([c1,c2,c3,c4],[150,250,500,750]):
+        with cw:
+            st.button(f"+{amt}ml",key=f"w{amt}",use_container_width=True,on_click=tap,args=(user,log_water,amt))
+    st.button("🔄 Reset Water",use_container_width=True,on_click=tap,args=(user,clear_water))
+
+def exercise_tab(user):
+    data=st.session_state.tracker_data[user]
+    with st.form("ex_f"):
+        st.markdown("**Add Custom Exercise**")
+        st.text_input("Exercise name",placeholder="e.g. Bench Press",key="ex_name")
+        c1,c2,c3=st.columns(3)
+        with c1: st.number_input("Sets",min_value=1,value=3,step=1,key="ex_sets")
+        with c2: st.number_input("Reps",min_value=1,value=10,step=1,key="ex_reps")
+        with c3: st.number_input("Weight (kg)",min_value=0,value=0,step=5,key="ex_wt")
+        st.text_area("Notes (optional)",height=55,key="ex_notes")
+        st.form_submit_button("➕ Add Exercise",type="primary",use_container_width=True,on_click=tap,args=(user,log_exercise))
+    st.markdown("""<div style='margin:10px 0 8px;padding:8px 10px;background:#f8fafc;border:1px solid #e2e8f0;border-radius:8px;'>
+        <span style='font-size:.86rem;font-weight:800;color:#0f172a;'>Today's Workout Plan</span>
+    </div>""", unsafe_allow_html=True)
+    if data['exercises']:
+        for i,ex in enumerate(data['exercises']):
+            ca,cb,cc=st.columns([5,1,1])
+            with ca:
+                wts=f"@ {ex['weight']}kg" if ex['weight']>0 else ""
+                nt=f'<br><span style="font-size:.67rem;color:#64748b;">{ex["notes"]}</span>' if ex['notes'] else ''
+                bg="#f0fdf4" if ex['completed'] else "white"; bd="#bbf7d0" if ex['completed'] else "#e2e8f0"
+                tick="✅" if ex['completed'] else "⭕"
+                st.markdown(f"""<div style="background:{bg};border-radius:7px;padding:8px 12px;border:1px solid {bd};margin-bottom:4px;font-size:.84rem;">
+                  {tick} <strong style="color:#0f172a;">{ex['name']}</strong>
+                  <span style="color:#64748b;font-size:.73rem;"> {ex['sets']}×{ex['reps']} {wts}</span>{nt}
+                </div>""",unsafe_allow_html=True)
+            with cb:
+                if not ex['completed']: st.button("✓",key=f"ck{i}",on_click=tap,args=(user,log_exercise_done,i))
+            with cc: st.button("🗑️",key=f"dx{i}",on_click=tap,args=(user,drop_exercise,i))
+    else: st.info("No exercises yet. Add one above!")
+
+def tracker_screen():
+    if not st.session_state.current_user or st.session_state.current_user not in st.session_state.users:
+        st.session_state.current_user=None; navigate_to("login"); return
+    panels=sidebar("tracker",live=False)
+    user=st.session_state.current_user
+    ensure_tracker(user)
+    ph("Daily Tracker","Log your nutrition, hydration & workouts.",back="dashboard")
+    live_panels(user,panels,tracker_body)
 
+def tracker_body(user):
+    tracker_summary(user)
     t1,t2,t3=st.tabs(["🍎 Food Log","💧 Water","🏋️ Exercises"])
+    with t1: food_tab(user)
+    with t2: water_tab(user)
+    with t3: exercise_tab(user)
 
-    with t1:
-        with st.form("food_f"):
-            st.markdown("""<div style='margin:6px 0 10px;padding:8px 10px;background:#f8fafc;border:1px solid #e2e8f0;border-radius:8px;'>
-              <span style='font-size:.86rem;font-weight:800;color:#0f172a;'>Add Food Entry</span>
-            </div>""", unsafe_allow_html=True)
-            fn=st.text_input("Food item",placeholder="e.g. Grilled Chicken")
-            c1,c2,c3,c4=st.columns(4)
-            with c1: cal=st.number_input("Calories",min_value=0,step=10,value=0)
-            with c2: pro=st.number_input("Protein g",min_value=0,step=1,value=0)
-            with c3: crb=st.number_input("Carbs g",min_value=0,step=1,value=0)
-            with c4: fat=st.number_input("Fat g",min_value=0,step=1,value=0)
-            if st.form_submit_button("➕ Add Food",type="primary",use_container_width=True):
-                if fn.strip():
-                    data['food_log'].append({'name':fn,'calories':cal,'protein':pro,'carbs':crb,'fat':fat,'time':datetime.now().strftime("%H:%M")})
-                    pts=award_xp(user,'food_logged'); d2=get_xp(user); d2['meals_logged']=d2.get('meals_logged',0)+1
-                    add_notif(user,f"🍎 +{pts} XP — {fn} ({cal} kcal)"); st.rerun()
-        if data['food_log']:
-            for i,e in enumerate(data['food_log']):
-                ca,cb=st.columns([5,1])
-                with ca:
-                    st.markdown(f"""<div style="background:white;border-radius:7px;padding:8px 12px;border:1px solid #e2e8f0;margin-bottom:4px;font-size:.82rem;color:#334155;">
-                      <strong style="color:#0f172a;">{e['time']}</strong> · {e['name']}
-                      <span style="float:right;color:#64748b;font-size:.72rem;">{e['calories']} kcal · P:{e['protein']}g C:{e['carbs']}g F:{e['fat']}g</span>
-                    </div>""",unsafe_allow_html=True)
-                with cb:
-                    if st.button("🗑️",key=f"df{i}"): data['food_log'].pop(i); st.rerun()
-        else: st.info("No food entries yet.")
+# ═══════════════════════════════════════════════════════════
+#  ANALYTICS — vectorised trends over the day history
+# ═══════════════════════════════════════════════════════════
+WATER_GOAL=3000
+ANALYTICS_RANGES={"Last 30 days":30,"Last 90 days":90,"Last 6 months":182,"Last year":365,"All time":None}
+
+# Keyed by the store's per-user history version, so the frame is rebuilt only after a
+# flush has recorded new tracker events; every other rerun is a cache hit.
+@st.cache_data(show_spinner=False,max_entries=256)
+def history_analytics(user,version):
+    rows=get_progress_store().load_days(user)
+    if not rows: return None
+    df=pd.DataFrame.from_records(rows,columns=['day',*HISTORY_FIELDS])
+    df.index=pd.to_datetime(df.pop('day')); df=df.asfreq('D')  # untracked days become NaN rows
+    kcal=df[['protein','carbs']].mul(4).join(df['fat'].mul(9))
+    energy=kcal.sum(axis=1).replace(0,np.nan)
+    for k in ('protein','carbs','fat'): df[f'{k}_pct']=kcal[k]/energy*100
+    df['hydrated']=np.where(df['water'].isna(),np.nan,(df['water']>=WATER_GOAL).astype(float))
+    for k in ('calories','water','volume'):
+        df[f'{k}_7d']=df[k].rolling(7,min_periods=1).mean()
+        df[f'{k}_28d']=df[k].rolling(28,min_periods=1).mean()
+    weekly=df[['volume','ex_done','calories','water']].resample('W-SUN').agg({'volume':'sum','ex_done':'sum','calories':'mean','water':'mean'})
+    return df,weekly
+
+def analytics_summary(df):
+    tracked=df['water'].notna(); hyd=df['hydrated'][tracked].to_numpy()
+    run=hyd[:-1] if len(hyd) and hyd[-1]<1 and df.index[-1].date()==date.today() else hyd  # today isn't over yet
+    misses=np.flatnonzero(run[::-1]<1)
+    tot=df[['protein','carbs','fat']].sum()*[4,4,9]; energy=tot.sum() or np.nan
+    return {'days':int(tracked.sum()),'calories':df['calories'].mean(),'volume':df['volume'].sum(),
+            'adherence':np.nanmean(hyd)*100 if len(hyd) else 0.0,'streak':int(misses[0]) if len(misses) else len(run),
+            'macros':(tot/energy*100).round(0).fillna(0).astype(int).to_dict()}
+
+def analytics_screen():
+    if not st.session_state.current_user or st.session_state.current_user not in st.session_state.users:
+        st.session_state.current_user=None; navigate_to("login"); return
+    sidebar("analytics"); user=st.session_state.current_user
+    ensure_tracker(user)
+    ph("Progress & Analytics","Trends across every day you've tracked.",back="tracker")
+    res=history_analytics(user,get_progress_store().history_version(user))
+    if res is None: st.info("No history yet — log food, water or a workout and it will show up here."); return
+    span=st.selectbox("Range",list(ANALYTICS_RANGES),index=1,key="an_range")
+    df,weekly=res; n=ANALYTICS_RANGES[span]
+    if n: start=df.index[-1]-pd.Timedelta(days=n-1); df=df[df.index>=start]; weekly=weekly[weekly.index>=start]
+    sm=analytics_summary(df); mc=sm['macros']
+    st.markdown(f"""<div style="display:flex;gap:8px;margin-bottom:1rem;flex-wrap:wrap;">
+      <div style="background:white;border-radius:9px;padding:9px 14px;border:1px solid #e2e8f0;flex:1;min-width:90px;text-align:center;">
+        <div style="font-size:1.1rem;font-weight:800;color:#0f172a;">{sm['days']}</div>
+        <div style="font-size:.6rem;color:#64748b;font-weight:600;">📅 days tracked</div></div>
+      <div style="background:white;border-radius:9px;padding:9px 14px;border:1px solid #e2e8f0;flex:1;min-width:90px;text-align:center;">
+        <div style="font-size:1.1rem;font-weight:800;color:#0f172a;">{sm['calories']:.0f}</div>
+        <div style="font-size:.6rem;color:#64748b;font-weight:600;">🔥 avg kcal/day</div></div>
+      <div style="background:white;border-radius:9px;padding:9px 14px;border:1px solid #e2e8f0;flex:1;min-width:90px;text-align:center;">
+        <div style="font-size:1.1rem;font-weight:800;color:#0f172a;">{sm['adherence']:.0f}%</div>
+        <div style="font-size:.6rem;color:#64748b;font-weight:600;">💧 days at {WATER_GOAL}ml · streak {sm['streak']}</div></div>
+      <div style="background:white;border-radius:9px;padding:9px 14px;border:1px solid #e2e8f0;flex:1;min-width:90px;text-align:center;">
+        <div style="font-size:1.1rem;font-weight:800;color:#0f172a;">{sm['volume']:,.0f} kg</div>
+        <div style="font-size:.6rem;color:#64748b;font-weight:600;">🏋️ training volume</div></div>
+      <div style="background:#e0fffe;border-radius:9px;padding:9px 14px;border:1px solid #13ecec;flex:1;min-width:90px;text-align:center;">
+        <div style="font-size:1.1rem;font-weight:800;color:#0f172a;">{mc['protein']}/{mc['carbs']}/{mc['fat']}</div>
+        <div style="font-size:.6rem;color:#0d9488;font-weight:600;">🥗 P/C/F % kcal</div></div>
+    </div>""",unsafe_allow_html=True)
 
+    t1,t2,t3,t4=st.tabs(["🔥 Calories","🏋️ Training","🥗 Macros","💧 Hydration"])
+    with t1: st.line_chart(df[['calories','calories_7d','calories_28d']].rename(columns={'calories':'Daily','calories_7d':'7-day avg','calories_28d':'28-day avg'}))
     with t2:
-        goal_w=3000; pct=min(data['water']/goal_w,1.0)
-        col2="#22c55e" if pct>=1 else "#13ecec" if pct>=0.5 else "#f59e0b"
-        st.markdown(f"""<div style="text-align:center;margin:.8rem 0 1.2rem;">
-          <div style="font-size:3rem;font-weight:900;color:{col2};">{data['water']}</div>
-          <div style="color:#64748b;font-size:.88rem;font-weight:600;">ml of {goal_w}ml goal</div>
-          <div style="margin:10px auto;width:100%;max-width:320px;height:10px;background:#e2e8f0;border-radius:5px;overflow:hidden;">
-            <div style="width:{int(pct*100)}%;height:100%;background:{col2};border-radius:5px;"></div></div>
-          <div style="font-size:.75rem;color:#64748b;">{int(pct*100)}% of daily goal</div>
-        </div>""",unsafe_allow_html=True)
-        c1,c2,c3,c4=st.columns(4)
-        for cw,amt in zip([c1,c2,c3,c4],[150,250,500,750]):
-            with cw:
-                if st.button(f"+{amt}ml",key=f"w{amt}",use_container_width=True):
-                    data['water']+=amt; award_xp(user,'water_500',amt//60); _check_badges(user,get_xp(user)); st.rerun()
-        if st.button("🔄 Reset Water",use_container_width=True): data['water']=0; st.rerun()
-
-    with t3:
-        with st.form("ex_f"):
-            st.markdown("**Add Custom Exercise**")
-            en=st.text_input("Exercise name",placeholder="e.g. Bench Press")
-            c1,c2,c3=st.columns(3)
-            with c1: sets=st.number_input("Sets",min_value=1,value=3,step=1)
-            with c2: reps=st.number_input("Reps",min_value=1,value=10,step=1)
-            with c3: wt_kg=st.number_input("Weight (kg)",min_value=0,value=0,step=5)
-            notes=st.text_area("Notes (optional)",height=55)
-            if st.form_submit_button("➕ Add Exercise",type="primary",use_container_width=True):
-                if en.strip():
-                    data['exercises'].append({'name':en,'sets':sets,'reps':reps,'weight':wt_kg,'notes':notes,'completed':False,'time':datetime.now().strftime("%H:%M")})
-                    add_notif(user,f"🏋️ Added: {en} ({sets}×{reps})"); st.rerun()
-        st.markdown("""<div style='margin:10px 0 8px;padding:8px 10px;background:#f8fafc;border:1px solid #e2e8f0;border-radius:8px;'>
-            <span style='font-size:.86rem;font-weight:800;color:#0f172a;'>Today's Workout Plan</span>
-        </div>""", unsafe_allow_html=True)
-        if data['exercises']:
-            for i,ex in enumerate(data['exercises']):
-                ca,cb,cc=st.columns([5,1,1])
-                with ca:
-                    wts=f"@ {ex['weight']}kg" if ex['weight']>0 else ""
-                    nt=f'<br><span style="font-size:.67rem;color:#64748b;">{ex["notes"]}</span>' if ex['notes'] else ''
-                    bg="#f0fdf4" if ex['completed'] else "white"; bd="#bbf7d0" if ex['completed'] else "#e2e8f0"
-                    tick="✅" if ex['completed'] else "⭕"
-                    st.markdown(f"""<div style="background:{bg};border-radius:7px;padding:8px 12px;border:1px solid {bd};margin-bottom:4px;font-size:.84rem;">
-                      {tick} <strong style="color:#0f172a;">{ex['name']}</strong>
-                      <span style="color:#64748b;font-size:.73rem;"> {ex['sets']}×{ex['reps']} {wts}</span>{nt}
-                    </div>""",unsafe_allow_html=True)
-                with cb:
-                    if not ex['completed']:
-                        if st.button("✓",key=f"ck{i}"):
-                            ex['completed']=True; pts=award_xp(user,'exercise_done')
-                            d2=get_xp(user); d2['exercises_done']=d2.get('exercises_done',0)+1
-                            _check_badges(user,d2); add_notif(user,f"✅ +{pts} XP — {ex['name']}"); st.rerun()
-                with cc:
-                    if st.button("🗑️",key=f"dx{i}"): data['exercises'].pop(i); st.rerun()
-        else: st.info("No exercises yet. Add one above!")
+        st.bar_chart(weekly[['volume']].rename(columns={'volume':'Weekly volume (kg)'}))
+        st.line_chart(df[['volume_7d','volume_28d']].rename(columns={'volume_7d':'7-day avg','volume_28d':'28-day avg'}))
+    with t3: st.area_chart(df[['protein_pct','carbs_pct','fat_pct']].dropna().rename(columns={'protein_pct':'Protein %','carbs_pct':'Carbs %','fat_pct':'Fat %'}))
+    with t4: st.line_chart(df[['water','water_7d']].assign(goal=WATER_GOAL).rename(columns={'water':'Daily ml','water_7d':'7-day avg','goal':'Goal'}))
 
 # ═══════════════════════════════════════════════════════════
 #  FEEDBACK
@@ -1135,8 +2807,7 @@ def feedback_screen():
         with c2: st.selectbox("Priority",["Low","Medium","High"],index=1,key="fb_pri")
         if st.form_submit_button("🚀 Submit Feedback",type="primary",use_container_width=True):
             if comments.strip():
-                pts=award_xp(user,'feedback'); d2=get_xp(user)
-                if 'feedback_giver' not in d2.get('badges',[]): d2.setdefault('badges',[]).append('feedback_giver')
+                pts=award_xp(user,'feedback'); record_event(user,'feedback')
                 add_notif(user,f"📨 +{pts} XP — {cat} feedback received!","success"); st.success(f"✅ Thank you! +{pts} XP earned.")
             else: st.warning("Please share your thoughts before submitting.")
 
@@ -1158,7 +2829,7 @@ def settings_screen():
             st.markdown("<div style='height:27px;'></div>",unsafe_allow_html=True)
             if st.button("Save",key="sv_nm",type="primary"):
                 (u['profile'] if u.get('profile') else u)['fullname']=nn
-                save_users_to_file(st.session_state.users)
+                save_user(user)
                 add_notif(user,"✏️ Name updated."); st.success("Saved!")
         st.markdown(f"<div style='padding:8px 0;border-top:1px solid #f1f5f9;margin-top:4px;'><strong style='font-size:.83rem;'>Email</strong><br><span style='color:#64748b;font-size:.78rem;'>{u.get('email','')}</span></div>",unsafe_allow_html=True)
 
@@ -1191,6 +2862,7 @@ def settings_screen():
             allergies = st.text_input("Allergies", value=p.get('allergies',''), key="set_allergies", placeholder="e.g. Peanuts")
 
         if st.button("Save Profile Preferences", key="sv_profile", type="primary", use_container_width=True):
+            get_prompt_registry().invalidate(p)
             u.setdefault('profile', {})
             u['profile'].update({
                 'sport': sp,
@@ -1200,7 +2872,7 @@ def settings_screen():
                 'goal': goal,
                 'allergies': allergies.strip(),
             })
-            save_users_to_file(st.session_state.users)
+            save_user(user)
             add_notif(user, "⚙️ Profile preferences updated.", "success")
             st.success("Profile settings saved.")
 
@@ -1220,9 +2892,10 @@ def settings_screen():
                     pass
                 with col3:
                     if st.button("Remove", key=f"rm_inj_{idx}", use_container_width=True):
+                        get_prompt_registry().invalidate(p)
                         injuries.pop(idx)
                         u.setdefault('profile', {})['injuries'] = injuries
-                        save_users_to_file(st.session_state.users)
+                        save_user(user)
                         add_notif(user, f"Injury '{injury}' removed.", "info")
                         st.rerun()
         
@@ -1235,9 +2908,10 @@ def settings_screen():
             if st.button("Add", key="add_injury_btn", use_container_width=True):
                 if new_injury.strip():
                     if new_injury.strip() not in injuries:
+                        get_prompt_registry().invalidate(p)
                         injuries.append(new_injury.strip())
                         u.setdefault('profile', {})['injuries'] = injuries
-                        save_users_to_file(st.session_state.users)
+                        save_user(user)
                         add_notif(user, f"📍 Injury '{new_injury.strip()}' added.", "info")
                         st.rerun()
                     else:
@@ -1308,16 +2982,36 @@ def settings_screen():
     st.markdown("<p style='font-size:.62rem;font-weight:700;text-transform:uppercase;color:#94a3b8;margin:1rem 0 7px;'>GEMINI AI STATUS</p>",unsafe_allow_html=True)
     if has_key: st.success("✅ Gemini 3 Flash Preview connected via .streamlit/secrets.toml")
     else: st.warning("⚠️ Set GEMINI_API_KEY in .streamlit/secrets.toml — get a free key at aistudio.google.com")
+    ps=get_gemini_client().pool_stats()
+    st.caption(f"Connection pool: {ps['hits']} reused · {ps['misses']} new · max {ps['pool_maxsize']} per host")
+    rl=get_rate_limiter().stats()
+    st.caption(f"Rate limiter: {rl['granted']} admitted · {rl['rejected']} turned away · {rl['throttled_429']}× 429 · "
+               f"avg wait {rl['avg_wait_s']:.2f}s · {get_gemini_jobs().queued()} queued")
+    cs=get_response_cache().stats()
+    st.caption(f"Response cache: {cs['hit_ratio']:.0%} hit ratio · {cs['hits']} hits · {cs['misses']} misses · {cs['entries']} cached")
+    pr=get_prompt_registry().stats()
+    st.caption(f"System prompts: {pr['prompts']} cached · {pr['builds']} built · {pr['hits']} reused · {pr['remote']} registered with Gemini")
+    cx=get_context_builder().stats()
+    st.caption(f"Context: ~{cx['avg_input_tokens']:.0f} input tokens per call over {cx['calls']} calls · "
+               f"budget {cx['budget']} · {cx['summarised_turns']} older turns summarised")
+    tel=get_telemetry(); ts=tel.stats()
+    with st.expander(f"📈 Gemini telemetry · {ts['calls']} calls"):
+        st.caption(f"Latency p50 {tel.percentile('request',.5):.2f}s · p95 {tel.percentile('request',.95):.2f}s · "
+                   f"TTFB p50 {tel.percentile('ttfb',.5):.2f}s · p95 {tel.percentile('ttfb',.95):.2f}s")
+        st.caption(f"Tokens: {ts['tokens']['prompt']} prompt · {ts['tokens']['completion']} completion · "
+                   f"{ts['tokens']['cached']} cached · {ts['attempts']} HTTP attempts · outcomes {ts['outcomes']}")
+        st.code(tel.prometheus(),language="text")
 
     st.markdown("<p style='font-size:.62rem;font-weight:700;text-transform:uppercase;color:#94a3b8;margin:1rem 0 7px;'>NOTIFICATIONS</p>",unsafe_allow_html=True)
-    notifs=st.session_state.notifications.get(user,[])
+    feed=notif_feed(user); start=st.session_state.get('notif_page',0)*NOTIF_PAGE
+    notifs=feed.page(start,NOTIF_PAGE)
     if notifs:
         with st.container(border=True):
             ca,cb=st.columns([4,1])
-            with ca: st.markdown(f"<b style='color:#0f172a;'>{len(notifs)}</b> total (<span style='color:#0f172a;'>{unread(user)} unread</span>)",unsafe_allow_html=True)
+            with ca: st.markdown(f"<b style='color:#0f172a;'>{feed.total}</b> total (<span style='color:#0f172a;'>{feed.unread} unread</span>)",unsafe_allow_html=True)
             with cb:
                 if st.button("Mark read",key="mr"): mark_read(user); st.rerun()
-            for n in notifs[:8]:
+            for n in notifs:
                 ic="🔵" if not n['read'] else "⚪"
                 bg = "#f0fefe" if not n['read'] else "#ffffff"
                 st.markdown(f"""
@@ -1326,6 +3020,14 @@ def settings_screen():
                   <div style='font-size:.63rem;color:#94a3b8;margin-top:3px;'>{n['time']}</div>
                 </div>
                 """,unsafe_allow_html=True)
+            if start or start+NOTIF_PAGE<feed.total:
+                pa,pb=st.columns(2)
+                with pa:
+                    if st.button("◀ Newer",key="nf_newer",disabled=not start,use_container_width=True):
+                        st.session_state.notif_page-=1; st.rerun()
+                with pb:
+                    if st.button("Older ▶",key="nf_older",disabled=start+NOTIF_PAGE>=feed.total,use_container_width=True):
+                        st.session_state.notif_page=start//NOTIF_PAGE+1; st.rerun()
     else: st.info("No notifications yet.")
 
     st.markdown("<p style='font-size:.62rem;font-weight:700;text-transform:uppercase;color:#ef4444;margin:1rem 0 7px;'>DANGER ZONE</p>",unsafe_allow_html=True)
@@ -1334,12 +3036,12 @@ def settings_screen():
         c1, c2 = st.columns(2)
         with c1:
             if st.button("🗑️ Clear Chat History",key="clrch",use_container_width=True):
-                st.session_state.chat_history[user]=[]; add_notif(user,"Chat history cleared."); st.success("Cleared.")
+                st.session_state.chat_history[user]=[]; reset_chat_view(user); add_notif(user,"Chat history cleared."); st.success("Cleared.")
         with c2:
             if st.button("🔄 Reset Today's Tracker",key="rsttk",use_container_width=True):
                 ensure_tracker(user); exs=copy.deepcopy(DEFAULT_EX); now_t=datetime.now().strftime("%H:%M")
                 for e in exs: e['time']=now_t
-                st.session_state.tracker_data[user]={'food_log':[],'water':0,'exercises':exs}
+                st.session_state.tracker_data[user]=new_tracker(exs)
                 add_notif(user,"Tracker reset."); st.success("Tracker reset!")
 
 # ═══════════════════════════════════════════════════════════
@@ -1347,10 +3049,16 @@ def settings_screen():
 # ═══════════════════════════════════════════════════════════
 if __name__=="__main__":
     pg=st.session_state.page
-    if   pg=='login':      login_screen()
-    elif pg=='onboarding': onboarding_screen()
-    elif pg=='dashboard':  dashboard_screen()
-    elif pg=='tracker':    tracker_screen()
-    elif pg=='feedback':   feedback_screen()
-
-    elif pg=='settings':   settings_screen()
+    try:
+        if   pg=='login':      login_screen()
+        elif pg=='onboarding': onboarding_screen()
+        elif pg=='dashboard':  dashboard_screen()
+        elif pg=='tracker':    tracker_screen()
+        elif pg=='analytics':  analytics_screen()
+        elif pg=='feedback':   feedback_screen()
+
+        elif pg=='settings':   settings_screen()
+    finally:
+        # st.rerun() unwinds through here too, so every run ends with a flush
+        try: flush_progress()
+        except Exception as e: logger.error("Progress flush failed: %s", e)
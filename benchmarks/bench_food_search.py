@@ -0,0 +1,69 @@
+"""Type-ahead latency of the SQLite food catalog (prefix B-tree + trigram index).
+
+    python benchmarks/bench_food_search.py --items 100000 --queries 500
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+WORDS = ["chicken", "beef", "salmon", "tofu", "paneer", "rice", "oats", "quinoa", "lentil", "bean", "egg", "yogurt",
+         "milk", "banana", "apple", "mango", "berry", "almond", "peanut", "potato", "pasta", "bread", "wrap", "salad",
+         "curry", "soup", "shake", "bar", "smoothie", "granola", "cheese", "turkey", "tuna", "shrimp", "spinach"]
+STYLES = ["grilled", "baked", "boiled", "fried", "roasted", "steamed", "raw", "spicy", "low fat", "organic", "homestyle"]
+
+
+def synthetic_rows(n, seed=7):
+    rng = random.Random(seed)
+    for i in range(n):
+        name = f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} ({rng.choice(STYLES)}) #{i}"
+        yield {"name": name, "serving": "100 g", "calories": rng.randint(20, 600), "protein": rng.randint(0, 40),
+               "carbs": rng.randint(0, 80), "fat": rng.randint(0, 30)}
+
+
+def queries(n, seed=11):
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        word = rng.choice(WORDS + STYLES)
+        kind = rng.random()
+        if kind < 0.5:
+            out.append(word[:rng.randint(1, len(word))])            # half-typed prefix
+        elif kind < 0.8:
+            out.append(word[rng.randint(1, max(1, len(word) - 3)):])  # infix
+        else:
+            out.append(f"{word} {rng.choice(WORDS)[:3]}")            # two words
+    return out
+
+
+def summarise(samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return f"p50 {statistics.median(samples):7.3f} ms   p95 {p95:7.3f} ms   max {samples[-1]:7.3f} ms"
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--items", type=int, default=100000)
+    ap.add_argument("--queries", type=int, default=500)
+    ap.add_argument("--budget-ms", type=float, default=5.0, help="fail if p95 exceeds this")
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        db = app.FoodDB(os.path.join(tmp, "foods.db"), csv_path=None)
+        t0 = time.perf_counter()
+        db.load_rows(synthetic_rows(args.items))
+        print(f"built {db.count()} items in {time.perf_counter() - t0:.1f} s")
+        samples = []
+        for q in queries(args.queries):
+            t0 = time.perf_counter()
+            db.search(q)
+            samples.append((time.perf_counter() - t0) * 1000)
+        print(f"search  {summarise(samples)}")
+        p95 = sorted(samples)[min(len(samples) - 1, int(len(samples) * 0.95))]
+        sys.exit(0 if p95 <= args.budget_ms else 1)
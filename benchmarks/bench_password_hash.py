@@ -0,0 +1,60 @@
+"""Login verification latency for each password-hash cost, to pick one that fits the p99 budget.
+
+    python benchmarks/bench_password_hash.py --logins 40 --concurrency 8 --budget-ms 250
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+COSTS = [("scrypt", (2 ** 13, 8, 1)), ("scrypt", (2 ** 14, 8, 1)), ("scrypt", (2 ** 15, 8, 1)),
+         ("scrypt", (2 ** 16, 8, 1)), ("pbkdf2_sha256", (200000,)), ("pbkdf2_sha256", (600000,)),
+         ("pbkdf2_sha256", (1200000,))]
+
+
+def pct(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def run(scheme, params, logins, concurrency, workers):
+    stored = app.hash_password("correct horse battery staple", scheme, params)
+    pool = ThreadPoolExecutor(max_workers=workers)  # stands in for get_password_pool()
+
+    def login(_):
+        # Measured from the session's point of view: queueing for a pool slot counts.
+        t0 = time.perf_counter()
+        assert pool.submit(app.verify_password, stored, "correct horse battery staple").result()
+        return (time.perf_counter() - t0) * 1000
+
+    with ThreadPoolExecutor(max_workers=concurrency) as sessions:
+        samples = list(sessions.map(login, range(logins)))
+    pool.shutdown()
+    return samples
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--logins", type=int, default=40, help="logins per cost setting")
+    ap.add_argument("--concurrency", type=int, default=8, help="sessions logging in at once")
+    ap.add_argument("--workers", type=int, default=2, help="PASSWORD_WORKERS")
+    ap.add_argument("--budget-ms", type=float, default=250.0, help="login p99 budget")
+    args = ap.parse_args()
+    best = {}  # strongest fitting cost per scheme; COSTS is ascending within a scheme
+    for scheme, params in COSTS:
+        if scheme == "scrypt" and not hasattr(app.hashlib, "scrypt"):
+            continue
+        samples = run(scheme, params, args.logins, args.concurrency, args.workers)
+        p99 = pct(samples, 0.99)
+        fits = p99 <= args.budget_ms
+        print(f"{scheme:13} {','.join(map(str, params)):>12}   p50 {statistics.median(samples):8.1f} ms"
+              f"   p99 {p99:8.1f} ms   {'ok' if fits else 'over budget'}")
+        if fits:
+            best[scheme] = params
+    for scheme, params in best.items():
+        print(f"strongest {scheme} cost within {args.budget_ms:.0f} ms p99: {','.join(map(str, params))}")
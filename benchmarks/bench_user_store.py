@@ -0,0 +1,81 @@
+"""Signup and profile-save latency: legacy users.toml rewrite vs the SQLite user store.
+
+    python benchmarks/bench_user_store.py --sizes 1000 10000 100000
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app  # noqa: E402
+
+PASSWORD = app.hash_password("pw")  # one real hash; deriving one per seeded user would dominate the run
+
+
+def fake_user(i):
+    return {"password": PASSWORD, "fullname": f"Athlete {i}", "email": f"a{i}@example.com",
+            "profile": {"fullname": f"Athlete {i}", "age": 18, "sport": "Cricket", "position": "Pitcher",
+                        "intensity": "Moderate", "diet": "Standard", "goal": "Improve Performance"}}
+
+
+def seed_toml(path, n):
+    app.save_users_to_file({f"user{i}": fake_user(i) for i in range(n)}, path)
+    return app.TomlUserStore(path)
+
+
+def seed_sqlite(path, n):
+    store = app.SQLiteUserStore(path)
+    with sqlite3.connect(path) as conn:
+        conn.executemany("INSERT INTO users VALUES (?,?,?)",
+                         [(f"user{i}", json.dumps(fake_user(i)), time.time()) for i in range(n)])
+    return store
+
+
+def timed(fn, ops):
+    samples = []
+    for i in range(ops):
+        t0 = time.perf_counter()
+        fn(i)
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+
+def summarise(samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return f"p50 {statistics.median(samples):9.2f} ms   p95 {p95:9.2f} ms"
+
+
+def run(backend, n, ops, tmp):
+    path = os.path.join(tmp, f"{backend}_{n}.{'toml' if backend == 'toml' else 'db'}")
+    store = seed_toml(path, n) if backend == "toml" else seed_sqlite(path, n)
+
+    def signup(i):
+        assert store.create(f"new{i}", fake_user(n + i))
+
+    def profile_save(i):
+        name = f"user{random.randrange(n)}"
+        rec = store.get(name); rec["profile"]["goal"] = "Muscle Gain"
+        store.put(name, rec)
+
+    return timed(signup, ops), timed(profile_save, ops)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    ap.add_argument("--ops", type=int, default=50, help="timed operations per SQLite measurement")
+    ap.add_argument("--toml-ops", type=int, default=5, help="timed operations per users.toml measurement")
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            for backend, ops in (("toml", args.toml_ops), ("sqlite", args.ops)):
+                signup, save = run(backend, n, ops, tmp)
+                print(f"{backend:6} {n:>7} users  signup       {summarise(signup)}")
+                print(f"{backend:6} {n:>7} users  profile-save {summarise(save)}")
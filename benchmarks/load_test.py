@@ -0,0 +1,256 @@
+"""Scripted multi-session load test of app.py against the mock Gemini server.
+
+Each simulated athlete signs up, onboards, clicks through the tracker, chats, saves
+settings and opens the progress page in its own AppTest session. Sessions share one
+process, so they share the app's process-wide caches, pools and stores as real users do.
+AppTest keeps a single global runtime per script run, so reruns are interleaved
+round-robin across the sessions in flight rather than executed in parallel; Gemini
+jobs, the password pool and the background user-store writers still run concurrently.
+Memory is measured in a separate tracemalloc pass so tracing does not skew the timings.
+
+    python benchmarks/load_test.py --sessions 20 --concurrency 4 --latency 0.3 --rate-429 0.05
+    python benchmarks/load_test.py --thresholds benchmarks/load_thresholds.json   # exit 1 on regression
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+import mock_gemini  # noqa: E402
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+COPY_IGNORE = shutil.ignore_patterns(".git", "*.db", "*.db-*", "users.toml", "gemini_calls.jsonl", "coachbot.log*",
+                                     "__pycache__", "benchmarks")
+
+
+def pct(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))] if samples else 0.0
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reruns = defaultdict(list)  # page -> ms
+        self.chat = []                   # seconds from send to reply
+        self.errors = []
+
+    def rerun(self, at, fn=None):
+        if fn:
+            fn()
+        t0 = time.perf_counter()
+        at.run()
+        ms = (time.perf_counter() - t0) * 1000
+        if at.exception:
+            raise RuntimeError(f"{at.session_state.page}: {at.exception[0].message}")
+        with self.lock:
+            self.reruns[at.session_state.page].append(ms)
+
+
+def button(at, key=None, label=None):
+    for b in at.button:
+        if (key and b.key == key) or (label and label in b.label):
+            return b
+    raise KeyError(key or label)
+
+
+def athlete_session(i, app_path, rec, chats, poll):
+    # A generator: yields after every rerun (True) or idle chat poll (False) so the driver
+    # can interleave sessions; returns the finished AppTest.
+    at = AppTest.from_file(app_path, default_timeout=120)
+    at.session_state["show_startup"] = False
+    rec.rerun(at); yield True
+    user = f"athlete{i}"
+    for k, v in dict(signup_fullname=f"Athlete {i}", signup_username=user, signup_email=f"{user}@example.com",
+                     signup_password="pw-" + user, signup_confirm="pw-" + user).items():
+        at.text_input(key=k).input(v)
+    rec.rerun(at, button(at, label="Create Account").click); yield True
+    at.selectbox(key="pf_sp").select("Cricket"); at.selectbox(key="pf_pos").select("Pitcher"); at.checkbox(key="pf_ok").check()
+    rec.rerun(at, button(at, label="Save & Continue").click); yield True
+    at.session_state[f"tutorial_shown_{user}"] = True
+    rec.rerun(at); yield True
+
+    rec.rerun(at, button(at, key="sbw250_dashboard").click); yield True
+    rec.rerun(at, button(at, key="sbex_dashboard").click); yield True
+    for n in range(chats):
+        t0 = time.perf_counter()
+        rec.rerun(at, lambda: at.chat_input[0].set_value(f"Session {i} question {n}: how should I train today?"))
+        last = time.perf_counter(); yield True
+        while at.session_state.ai_thinking and time.perf_counter() - t0 < 120:
+            if time.perf_counter() - last < poll:
+                yield False; continue
+            rec.rerun(at); last = time.perf_counter(); yield True
+        with rec.lock:
+            rec.chat.append(time.perf_counter() - t0)
+
+    rec.rerun(at, button(at, key="sb_tracker_dashboard").click); yield True
+    rec.rerun(at, button(at, key="w500").click); yield True
+    at.text_input(key="food_name").input("Oats"); at.number_input(key="food_cal").set_value(300)
+    rec.rerun(at, button(at, label="Add Food").click); yield True
+    rec.rerun(at, button(at, key="sb_settings_tracker").click); yield True
+    rec.rerun(at, button(at, key="sv_profile").click); yield True
+    rec.rerun(at, button(at, key="sb_analytics_settings").click); yield True
+    rec.rerun(at, button(at, key="sb_out_analytics").click)
+    return at
+
+
+def drive(sessions, concurrency, start, rec):
+    # Keeps `concurrency` sessions in flight, stepping each in turn; returns the finished AppTests.
+    pending, active, done = iter(range(start, start + sessions)), [], []
+    while True:
+        while len(active) < concurrency:
+            i = next(pending, None)
+            if i is None:
+                break
+            active.append(athlete_session(i, *rec.session_args))
+        if not active:
+            return done
+        busy = False
+        for gen in list(active):
+            try:
+                busy |= next(gen)
+            except StopIteration as stop:
+                active.remove(gen); done.append(stop.value)
+            except Exception as e:  # one broken session should not hide the rest of the report
+                active.remove(gen); rec.errors.append(repr(e))
+        if not busy:
+            time.sleep(0.01)
+
+
+def store_writer(store, users, stop, samples, errors, interval):
+    # Competes with the sessions' signups and settings saves for the user store.
+    while not stop.is_set():
+        name = random.choice(users)
+        rec = store.get(name)
+        if rec is None:
+            time.sleep(0.01); continue
+        rec.setdefault("profile", {})["goal"] = random.choice(["Muscle Gain", "Improve Performance"])
+        t0 = time.perf_counter()
+        try:
+            store.put(name, rec)
+        except sqlite3.OperationalError as e:
+            errors.append(str(e))
+        samples.append((time.perf_counter() - t0) * 1000)
+        time.sleep(interval)
+
+
+def check(report, thresholds):
+    failures = []
+    pages = thresholds.get("rerun_p95_ms", {})
+    for page, stats in report["reruns"].items():
+        limit = pages.get(page, pages.get("*"))
+        if limit is not None and stats["p95_ms"] > limit:
+            failures.append(f"{page} rerun p95 {stats['p95_ms']:.0f} ms > {limit} ms")
+    for key, value in (("chat_p95_s", report["chat"]["p95_s"]), ("memory_per_session_kb", report["memory"]["per_session_kb"]),
+                       ("store_write_p95_ms", report["store"]["p95_ms"]), ("errors", len(report["errors"]))):
+        if key in thresholds and value > thresholds[key]:
+            failures.append(f"{key} {value:.1f} > {thresholds[key]}")
+    return failures
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--sessions", type=int, default=12)
+    ap.add_argument("--concurrency", type=int, default=4, help="sessions scripted at the same time")
+    ap.add_argument("--chats", type=int, default=2, help="chat messages per session")
+    ap.add_argument("--poll", type=float, default=0.2, help="seconds between reruns while a reply is pending")
+    ap.add_argument("--latency", type=float, default=0.2, help="mock Gemini seconds per call")
+    ap.add_argument("--jitter", type=float, default=0.1)
+    ap.add_argument("--chunk-delay", type=float, default=0.02)
+    ap.add_argument("--rate-429", type=float, default=0.0, help="fraction of Gemini calls answered with 429")
+    ap.add_argument("--user-store", choices=["sqlite", "toml"], default="sqlite", help="USER_STORE backend under test")
+    ap.add_argument("--writers", type=int, default=2, help="background threads rewriting user records")
+    ap.add_argument("--write-interval", type=float, default=0.02, help="seconds between one writer's saves")
+    ap.add_argument("--memory-sessions", type=int, default=3, help="sessions replayed under tracemalloc")
+    ap.add_argument("--thresholds", help="JSON file of regression limits; exit 1 if any is exceeded")
+    ap.add_argument("--json", help="also write the report here")
+    args = ap.parse_args()
+    thresholds = os.path.abspath(args.thresholds) if args.thresholds else None
+    json_out = os.path.abspath(args.json) if args.json else None
+
+    srv = mock_gemini.serve(0, latency=args.latency, jitter=args.jitter, chunk_delay=args.chunk_delay,
+                            rate_429=args.rate_429, retry_after=1)
+    work = tempfile.mkdtemp(prefix="coachbot-load-")
+    shutil.copytree(ROOT, work, ignore=COPY_IGNORE, dirs_exist_ok=True)
+    os.chdir(work)
+    os.environ.update(GEMINI_API_KEY="load-test", GEMINI_API_BASE=f"http://127.0.0.1:{srv.server_address[1]}",
+                      USER_STORE=args.user_store)
+    os.environ.pop("METRICS_PORT", None)
+    sys.path.insert(0, work)
+    import app  # noqa: E402  (the copy under test, for its store classes)
+
+    rec = Recorder()
+    rec.session_args = (os.path.join(work, "app.py"), rec, args.chats, args.poll)
+    drive(1, 1, -1, rec)  # warm imports, caches and pools outside the measurement
+    rec.reruns.clear(); rec.chat.clear()
+
+    store = app.TomlUserStore(app.USERS_FILE) if args.user_store == "toml" else app.SQLiteUserStore(app.USERS_DB)
+    names = ["athlete-1"] + [f"athlete{i}" for i in range(args.sessions)]
+    stop = threading.Event(); write_ms, write_errors = [], []
+    writers = [threading.Thread(target=store_writer, args=(store, names, stop, write_ms, write_errors, args.write_interval),
+                                daemon=True) for _ in range(args.writers)]
+    for w in writers:
+        w.start()
+    t0 = time.time()
+    drive(args.sessions, args.concurrency, 0, rec)
+    wall = time.time() - t0
+    stop.set()
+
+    # Retained memory: replay a few sessions under tracemalloc and keep them alive.
+    probe = Recorder(); probe.session_args = (rec.session_args[0], probe, 1, args.poll)
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    kept = drive(args.memory_sessions, args.memory_sessions, args.sessions, probe)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rec.errors += probe.errors
+
+    report = {
+        "sessions": args.sessions, "concurrency": args.concurrency, "wall_s": round(wall, 2),
+        "reruns": {page: {"n": len(v), "p50_ms": statistics.median(v), "p95_ms": pct(v, .95), "max_ms": max(v)}
+                   for page, v in sorted(rec.reruns.items())},
+        "chat": {"n": len(rec.chat), "p50_s": statistics.median(rec.chat) if rec.chat else 0.0,
+                 "p95_s": pct(rec.chat, .95), "p99_s": pct(rec.chat, .99)},
+        "memory": {"per_session_kb": (current - base) / 1024 / max(len(kept), 1), "peak_mb": peak / 2 ** 20},
+        "store": {"backend": args.user_store, "writes": len(write_ms), "p50_ms": statistics.median(write_ms) if write_ms else 0.0,
+                  "p95_ms": pct(write_ms, .95), "p99_ms": pct(write_ms, .99), "lock_errors": len(write_errors)},
+        "gemini": dict(srv.RequestHandlerClass.stats),
+        "errors": rec.errors,
+    }
+    srv.shutdown()
+
+    print(f"{args.sessions} sessions × {args.concurrency} concurrent in {wall:.1f} s")
+    for page, s in report["reruns"].items():
+        print(f"  rerun {page:<11} n={s['n']:<4} p50 {s['p50_ms']:7.0f} ms   p95 {s['p95_ms']:7.0f} ms   max {s['max_ms']:7.0f} ms")
+    c = report["chat"]
+    print(f"  chat        n={c['n']:<4} p50 {c['p50_s']:6.2f} s   p95 {c['p95_s']:6.2f} s   p99 {c['p99_s']:6.2f} s")
+    m = report["memory"]
+    print(f"  memory      {m['per_session_kb']:.0f} KB retained per session, peak {m['peak_mb']:.1f} MB traced")
+    s = report["store"]
+    print(f"  {s['backend']} user store  {s['writes']} contended writes   p50 {s['p50_ms']:.1f} ms   "
+          f"p95 {s['p95_ms']:.1f} ms   p99 {s['p99_ms']:.1f} ms   lock errors {s['lock_errors']}")
+    print(f"  mock gemini {report['gemini']['requests']} calls, {report['gemini']['throttled']} answered 429")
+    for e in rec.errors:
+        print(f"  session error: {e}")
+    if json_out:
+        with open(json_out, "w") as fh:
+            json.dump(report, fh, indent=2)
+    shutil.rmtree(work, ignore_errors=True)
+
+    if thresholds:
+        with open(thresholds) as fh:
+            failures = check(report, json.load(fh))
+        for f in failures:
+            print(f"REGRESSION {f}")
+        sys.exit(1 if failures else 0)
@@ -0,0 +1,141 @@
+"""Local stand-in for the Gemini REST API.
+
+Serves ``generateContent``, ``streamGenerateContent?alt=sse`` and
+``cachedContents`` so the chat path can be exercised without a real key.
+``--latency``/``--jitter`` add a per-request delay and ``--rate-429`` answers
+that fraction of generate calls with 429 + Retry-After:
+
+    python benchmarks/mock_gemini.py --port 8765 --chunk-delay 0.05 --latency 0.3 --rate-429 0.05
+    GEMINI_API_BASE=http://127.0.0.1:8765 GEMINI_API_KEY=test streamlit run app.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PATH_RE = re.compile(r"^/v1beta/models/(?P<model>[^:/]+):(?P<method>generateContent|streamGenerateContent)")
+
+
+def build_reply(payload, words=60):
+    contents = payload.get("contents") or [{}]
+    last = contents[-1].get("parts", [{}])[0].get("text", "")
+    filler = " ".join(f"drill{i}" for i in range(words))
+    # Non-ASCII on purpose: the body is raw UTF-8, as the real API sends it.
+    return f"Coach reply to: {last.strip()[:80]}. Great work 💪 — café • {filler}"
+
+
+def usage(payload, reply):
+    prompt_chars = len(json.dumps(payload))
+    return {"promptTokenCount": prompt_chars // 4, "candidatesTokenCount": len(reply) // 4,
+            "totalTokenCount": (prompt_chars + len(reply)) // 4}
+
+
+class MockGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = {"chunk_delay": 0.05, "chunk_words": 6, "first_token_delay": 0.0,
+              "latency": 0.0, "jitter": 0.0, "rate_429": 0.0, "retry_after": 1}
+    cached_contents = {}
+    stats = {"requests": 0, "throttled": 0}
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send_json(self, status, body, headers=()):
+        raw = json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        for k, v in headers:
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def do_POST(self):
+        match = PATH_RE.match(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if self.path.startswith("/v1beta/cachedContents"):
+            name = "cachedContents/" + hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:12]
+            self.cached_contents[name] = payload
+            self._send_json(200, {"name": name, "model": payload.get("model")})
+            return
+        if payload.get("cachedContent") and payload["cachedContent"] not in self.cached_contents:
+            self._send_json(404, {"error": {"code": 404, "message": "cached content not found"}})
+            return
+        if not match:
+            self._send_json(404, {"error": {"code": 404, "message": "not found"}})
+            return
+        self.stats["requests"] += 1
+        cfg = self.config
+        time.sleep(max(0.0, cfg["latency"] + random.uniform(-cfg["jitter"], cfg["jitter"])))
+        if random.random() < cfg["rate_429"]:
+            self.stats["throttled"] += 1
+            self._send_json(429, {"error": {"code": 429, "message": "Resource has been exhausted", "status": "RESOURCE_EXHAUSTED"}},
+                            headers=[("Retry-After", str(cfg["retry_after"]))])
+            return
+        reply = build_reply(payload)
+        if match.group("method") == "generateContent":
+            time.sleep(self.config["first_token_delay"])
+            self._send_json(200, {"candidates": [{"content": {"role": "model", "parts": [{"text": reply}]}}],
+                                  "usageMetadata": usage(payload, reply)})
+            return
+        try:
+            self._stream(payload, reply)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client cancelled mid-stream
+
+    def _stream(self, payload, reply):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        words = reply.split(" ")
+        step = self.config["chunk_words"]
+        time.sleep(self.config["first_token_delay"])
+        for i in range(0, len(words), step):
+            text = " ".join(words[i:i + step]) + (" " if i + step < len(words) else "")
+            event = {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}
+            if i + step >= len(words):
+                event["usageMetadata"] = usage(payload, reply)
+            self._write_chunk(f"data: {json.dumps(event, ensure_ascii=False)}\r\n\r\n".encode())
+            time.sleep(self.config["chunk_delay"])
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+def serve(port=0, **config):
+    """Start the mock server on a daemon thread and return it; ``port=0`` picks a free port."""
+    handler = type("ConfiguredHandler", (MockGeminiHandler,), {"config": {**MockGeminiHandler.config, **config},
+                                                              "stats": {"requests": 0, "throttled": 0}})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--chunk-delay", type=float, default=0.05, help="seconds between SSE chunks")
+    ap.add_argument("--chunk-words", type=int, default=6, help="words per SSE chunk")
+    ap.add_argument("--first-token-delay", type=float, default=0.0, help="seconds before the first chunk")
+    ap.add_argument("--latency", type=float, default=0.0, help="seconds added to every generate call")
+    ap.add_argument("--jitter", type=float, default=0.0, help="± seconds of uniform jitter on --latency")
+    ap.add_argument("--rate-429", type=float, default=0.0, help="fraction of generate calls answered with 429")
+    ap.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with each 429")
+    args = ap.parse_args()
+    srv = serve(args.port, chunk_delay=args.chunk_delay, chunk_words=args.chunk_words,
+                first_token_delay=args.first_token_delay, latency=args.latency, jitter=args.jitter,
+                rate_429=args.rate_429, retry_after=args.retry_after)
+    print(f"Mock Gemini listening on http://127.0.0.1:{srv.server_address[1]}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        srv.shutdown()